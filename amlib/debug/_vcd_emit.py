@@ -0,0 +1,93 @@
+#
+# SPDX-License-Identifier: BSD-3-Clause
+
+""" Compiled kernel for formatting the body of the ILA's VCD files.
+
+If Numba is installed, emit_body is JIT-compiled, and formats value changes far faster than Python can.
+Numba is optional: without it, NUMBA_AVAILABLE is False, and the ILA formats its VCDs in plain Python instead.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+def emit_body(timestamps_ns, new_time, signals, values, widths, idents, ident_lengths, out_buf):
+    """ Formats a run of VCD value changes as ASCII text, into a preallocated buffer.
+
+    Parameters:
+        timestamps_ns -- An int64 array of the time of each change, in nanoseconds.
+        new_time      -- A boolean array; true for each change that needs a new #<time> line before it.
+        signals       -- An int64 array of the variable number each change applies to.
+        values        -- A uint64 array of the new value of each change.
+        widths        -- An int64 array of the width of each variable; single-bit variables are written bare.
+        idents        -- A (variables, longest identifier) uint8 array of each variable's VCD identifier code.
+        ident_lengths -- An int64 array of the length of each variable's identifier code.
+        out_buf       -- The uint8 array to write to; must be large enough to hold all of our text.
+
+    Returns the number of bytes written to out_buf.
+    """
+
+    position = 0
+    digits   = np.empty(20, dtype=np.uint8)
+    one      = np.uint64(1)
+
+    for i in range(len(values)):
+
+        # If we've moved on to a new time, write out a #<time> line.
+        if new_time[i]:
+            out_buf[position] = 35 # '#'
+            position += 1
+
+            time  = timestamps_ns[i]
+            count = 0
+            while True:
+                digits[count] = 48 + time % 10
+                time  //= 10
+                count  += 1
+                if time == 0:
+                    break
+
+            for j in range(count - 1, -1, -1):
+                out_buf[position] = digits[j]
+                position += 1
+
+            out_buf[position] = 10 # '\n'
+            position += 1
+
+        # Vectors are written as b<value> <ident>; single bits as <value><ident>.
+        n = signals[i]
+        if widths[n] != 1:
+            out_buf[position] = 98 # 'b'
+            position += 1
+
+        # Write our value in binary, without any leading zeroes.
+        value  = np.uint64(values[i])
+        length = 1
+        while (length < 64) and ((value >> np.uint64(length)) != 0):
+            length += 1
+
+        for bit in range(length - 1, -1, -1):
+            out_buf[position] = 49 if (value >> np.uint64(bit)) & one else 48
+            position += 1
+
+        if widths[n] != 1:
+            out_buf[position] = 32 # ' '
+            position += 1
+
+        for j in range(ident_lengths[n]):
+            out_buf[position] = idents[n, j]
+            position += 1
+
+        out_buf[position] = 10 # '\n'
+        position += 1
+
+    return position
+
+
+if NUMBA_AVAILABLE:
+    emit_body = njit(cache=True)(emit_body)
@@ -8,23 +8,35 @@
 
 """ Integrated logic analysis helpers. """
 
+import io
 import os
 import sys
-import math
+import gzip
+import queue
 import tempfile
 import pickle
+import struct
+import threading
+import unittest
+import unittest.mock
 import subprocess
 
 from abc             import ABCMeta, abstractmethod
+from functools       import cached_property
+
+import numpy as np
 
 from amaranth          import Signal, Module, Cat, Elaboratable, Memory, DomainRenamer, Mux
 from amaranth.hdl.ast  import Rose
 from amaranth.lib.cdc  import FFSynchronizer
-from amaranth.lib.fifo import SyncFIFOBuffered, AsyncFIFOBuffered
+from amaranth.lib.fifo import AsyncFIFO, AsyncFIFOBuffered, SyncFIFOBuffered
+from amaranth.sim      import Passive
 from vcd             import VCDWriter
 from vcd.gtkw        import GTKWSave
 
-from ..stream         import StreamInterface
+from ._vcd_emit       import NUMBA_AVAILABLE, emit_body
+
+from ..stream         import StreamInterface, connect_stream_to_fifo, connect_fifo_to_stream
 from ..stream.uart    import UARTMultibyteTransmitter
 from ..io.spi         import SPIDeviceInterface, SPIDeviceBus, SPIGatewareTestCase
 from ..test.utils     import GatewareTestCase, sync_test_case
@@ -50,13 +62,30 @@ class IntegratedLogicAnalyzer(Elaboratable):
 
     complete: Signal(), output
         Indicates when sampling is complete and ready to be read.
+    rearm: Signal(), input
+        A strobe that releases a completed capture once it has been read out.
+        With two or more pretrigger samples, pretrigger samples are kept in sample
+        memory; so they're only recorded again once a capture has been released by
+        this strobe, and triggers are ignored until they have been. The serial and
+        stream ILAs below release each capture themselves, once it's been read out.
+    other_buffer_draining: Signal(), output
+        This output is only available if `double_buffered` is True.
+        Indicates that a new capture has finished, but is waiting for the previous
+        capture to be released before it can be read out. No triggers are accepted
+        until then.
 
     captured_sample_number: Signal(), input
         Selects which sample the ILA will output. Effectively the address for the ILA's
-        sample buffer.
+        sample buffer. For compressed captures, samples must be read out in order,
+        starting from sample zero.
     captured_sample: Signal(), output
         The sample corresponding to the relevant sample number.
         Can be broken apart by using Cat(*signals).
+    trace_mask: Signal(len(banks)), input
+        This input is only available if `with_trace_mask` is True.
+        Each bit enables writes to one bank of sample memory, so groups of signals
+        can be switched off at runtime. Masked banks keep their previous contents.
+        Banks holding the repeat counts of a compressed capture are always written.
 
     Parameters
     ----------
@@ -73,13 +102,62 @@ class IntegratedLogicAnalyzer(Elaboratable):
         The number of our samples which should be captured _before_ the trigger.
         This also can act like an implicit synchronizer; so asynchronous inputs
         are allowed if this number is >= 1. Note that the trigger strobe is read
-        on the rising edge of the clock.
+        on the rising edge of the clock. Pretrigger samples are kept in sample
+        memory, so this can be up to sample_depth - 1. Triggers are ignored until
+        this many pretrigger samples have been seen; so the trigger sample is always
+        sample number `samples_pretrigger`.
     with_enable: bool
         This provides an 'enable' signal.
         Only samples with enable high will be captured.
+
+    compressed: bool
+        If True, runs of identical samples are stored as a single (sample, repeat count)
+        entry in sample memory, and are expanded again on readout. Captured traces rarely
+        change on every cycle, so this lets a small buffer hold a much longer capture.
+        In other words, a new entry is only started when our inputs change; until then,
+        each sample just updates the current entry's count of how many cycles it has lasted.
+    buffer_depth: int
+        The number of entries in the sample memory of a compressed capture.
+        Defaults to sample_depth. If a capture does not fit into the buffer, it is
+        cut short, and its last stored sample is repeated on readout.
+        With two or more pretrigger samples, sample memory is rounded up to a power
+        of two entries.
+    run_length_width: int
+        The width of the repeat counter stored with each entry of a compressed capture.
+        Longer runs are split across several entries. If None, the counter is made wide
+        enough that any run within a capture fits into a single entry.
+    bank_width: int
+        If provided, sample memory is split into banks of at most this many bits,
+        which are written side by side. Choosing the native width of the target's
+        block RAMs lets each bank map onto its own block RAM column.
+        If omitted, a single bank is used.
+
+    trace_levels: iterable of ints
+        If provided, the trace level of each of our signals, in the same order as `signals`.
+    trace_depth: int
+        If provided, only signals with a trace level of at most `trace_depth` are captured;
+        this way, detail can be traded for capture depth without touching the signal list.
+    with_trace_mask: bool
+        This provides a 'trace_mask' signal.
+    double_buffered: bool
+        If True, sample memory holds two buffers. Captures are written into one buffer
+        while the previous capture is read out of the other; so a new trigger can be
+        accepted right away, rather than once the previous capture has been released.
+        Not supported for compressed captures.
     """
 
-    def __init__(self, *, signals, sample_depth, domain="sync", sample_rate=60e6, samples_pretrigger=1, with_enable=False):
+    def __init__(self, *, signals, sample_depth, domain="sync", sample_rate=60e6, samples_pretrigger=1, with_enable=False,
+                 compressed=False, buffer_depth=None, run_length_width=8, bank_width=None,
+                 trace_levels=None, trace_depth=None, with_trace_mask=False, double_buffered=False):
+
+        signals = list(signals)
+        if (trace_levels is not None) and (len(trace_levels) != len(signals)):
+            raise ValueError(f"trace_levels has {len(trace_levels)} entries, but there are {len(signals)} signals")
+
+        # Only capture the signals within our trace depth.
+        if (trace_levels is not None) and (trace_depth is not None):
+            signals = [signal for signal, level in zip(signals, trace_levels) if level <= trace_depth]
+
         self.domain             = domain
         self.signals            = signals
         self.inputs             = Cat(*signals)
@@ -89,10 +167,40 @@ class IntegratedLogicAnalyzer(Elaboratable):
         self.sample_rate        = sample_rate
         self.sample_period      = 1 / sample_rate
 
+        self.compressed         = compressed
+        self.buffer_depth       = buffer_depth if buffer_depth else sample_depth
+        self.run_length_width   = run_length_width if compressed else 0
+
+        if compressed and (run_length_width is None):
+            self.run_length_width = max(1, (sample_depth - 1).bit_length())
+
+        # Compressed entries can't be kept in our pretrigger ring buffer; only our synchronizer's sample.
+        if compressed and (samples_pretrigger >= 2):
+            raise ValueError("compressed captures support at most one pretrigger sample")
+
+        # Our pretrigger ring buffer can wrap around for free if its depth is a power of two.
+        if samples_pretrigger >= 2:
+            self.buffer_depth = 2 ** (self.buffer_depth - 1).bit_length()
+
+        # When double buffered, the buffer we're using is the top bit of our memory address.
+        self.double_buffered = double_buffered
+        if double_buffered:
+            if compressed:
+                raise ValueError("compressed captures can't be double buffered")
+            self.memory_depth = 2 * 2 ** (self.buffer_depth - 1).bit_length()
+        else:
+            self.memory_depth = self.buffer_depth
+
         #
-        # Create a backing store for our samples.
+        # Create a backing store for our samples, split into banks along its width.
+        # Compressed entries carry their repeat count above the sample.
         #
-        self.mem = Memory(width=self.sample_width, depth=sample_depth, name="ila_buffer")
+        self.entry_width = self.sample_width + self.run_length_width
+        self.bank_width  = bank_width if bank_width else self.entry_width
+        self.banks = [
+            Memory(width=min(self.bank_width, self.entry_width - offset), depth=self.memory_depth, name=f"ila_buffer_{n}")
+            for n, offset in enumerate(range(0, self.entry_width, self.bank_width))
+        ]
 
 
         #
@@ -102,10 +210,18 @@ class IntegratedLogicAnalyzer(Elaboratable):
         if with_enable:
             self.enable = Signal()
 
+        self.with_trace_mask = with_trace_mask
+        if with_trace_mask:
+            self.trace_mask = Signal(len(self.banks), reset=2 ** len(self.banks) - 1)
+
         self.trigger   = Signal()
         self.capturing = Signal()
         self.sampling  = Signal()
         self.complete  = Signal()
+        self.rearm     = Signal()
+
+        if double_buffered:
+            self.other_buffer_draining = Signal()
 
         self.captured_sample_number = Signal(range(0, self.sample_depth))
         self.captured_sample        = Signal(self.sample_width)
@@ -115,68 +231,61 @@ class IntegratedLogicAnalyzer(Elaboratable):
         m  = Module()
         with_enable = self.with_enable
 
-        # Memory ports.
-        write_port = self.mem.write_port()
-        read_port  = self.mem.read_port(domain='comb')
-        m.submodules += [write_port, read_port]
+        # Memory ports. Each bank gets its own slice of our memory entries.
+        # We use synchronous read ports, which map onto real block RAM;
+        # so samples appear on captured_sample one cycle after they're addressed.
+        write_addr = Signal(range(0, self.buffer_depth))
+        write_data = Signal(self.entry_width)
+        write_en   = Signal()
+        read_addr  = Signal(range(0, self.buffer_depth))
+        read_data  = Signal(self.entry_width)
+
+        # When double buffered, we write into our active buffer, and read from the other one.
+        if self.double_buffered:
+            active_buffer = Signal()
+            write_addr_in_memory = Cat(write_addr, active_buffer)
+            read_addr_in_memory  = Cat(read_addr, ~active_buffer)
+        else:
+            write_addr_in_memory = write_addr
+            read_addr_in_memory  = read_addr
+
+        bank_offset = 0
+        for n, bank in enumerate(self.banks):
+            write_port = bank.write_port()
+            read_port  = bank.read_port(domain='sync')
+            m.submodules += [write_port, read_port]
+
+            bank_data = slice(bank_offset, bank_offset + bank.width)
+
+            # Banks that hold any of our repeat counts are always written; if they were masked,
+            # the samples in every other bank would no longer be expanded correctly on readout.
+            holds_run_length = (bank_offset + bank.width) > self.sample_width
+            if self.with_trace_mask and not holds_run_length:
+                bank_en = write_en & self.trace_mask[n]
+            else:
+                bank_en = write_en
+            m.d.comb += [
+                write_port.addr      .eq(write_addr_in_memory),
+                write_port.data      .eq(write_data[bank_data]),
+                write_port.en        .eq(bank_en),
+
+                read_port.addr       .eq(read_addr_in_memory),
+                read_data[bank_data] .eq(read_port.data),
+            ]
+            bank_offset += bank.width
 
         # If necessary, create synchronized versions of the relevant signals.
         if self.samples_pretrigger >= 1:
-            synced_inputs  = Signal.like(self.inputs)
             delayed_inputs = Signal.like(self.inputs)
 
             # the first stage captures the trigger
             # the second stage the first pretrigger sample
             m.submodules.pretrigger_samples = \
-                FFSynchronizer(self.inputs,  synced_inputs)
+                FFSynchronizer(self.inputs, delayed_inputs)
             if with_enable:
-                synced_enable  = Signal()
+                delayed_enable = Signal()
                 m.submodules.pretrigger_enable = \
-                    FFSynchronizer(self.enable, synced_enable)
-
-            if self.samples_pretrigger == 1:
-                m.d.comb += delayed_inputs.eq(synced_inputs)
-                if with_enable:
-                    delayed_enable = Signal()
-                    m.d.comb += delayed_enable.eq(synced_enable)
-            else: # samples_pretrigger >= 2
-                capture_fifo_width = self.sample_width
-                if with_enable:
-                    capture_fifo_width += 1
-
-                pretrigger_fill_counter = Signal(range(self.samples_pretrigger * 2))
-                pretrigger_filled       = Signal()
-                m.d.comb += pretrigger_filled.eq(pretrigger_fill_counter >= (self.samples_pretrigger - 1))
-
-                # fill up pretrigger FIFO with the number of pretrigger samples
-                if (not with_enable):
-                    synced_enable = 1
-                with m.If(synced_enable & ~pretrigger_filled):
-                    m.d.sync += pretrigger_fill_counter.eq(pretrigger_fill_counter + 1)
-
-                m.submodules.pretrigger_fifo = pretrigger_fifo =  \
-                    DomainRenamer(self.domain)(SyncFIFOBuffered(width=capture_fifo_width, depth=self.samples_pretrigger + 1))
-
-                m.d.comb += [
-                    pretrigger_fifo.w_data.eq(synced_inputs),
-                    # We only want to capture enabled samples
-                    # in the pretrigger period.
-                    # Since we also capture the enable signal,
-                    # we capture unconditionally after the pretrigger FIFO
-                    # has been filled
-                    pretrigger_fifo.w_en.eq(Mux(pretrigger_filled, 1, synced_enable)),
-                    # buffer the specified number of pretrigger samples
-                    pretrigger_fifo.r_en.eq(pretrigger_filled),
-
-                    delayed_inputs.eq(pretrigger_fifo.r_data),
-                ]
-
-                if with_enable:
-                    delayed_enable = Signal()
-                    m.d.comb += [
-                        pretrigger_fifo.w_data[-1].eq(synced_enable),
-                        delayed_enable.eq(pretrigger_fifo.r_data[-1]),
-                    ]
+                    FFSynchronizer(self.enable, delayed_enable)
 
         else:
             delayed_inputs = Signal.like(self.inputs)
@@ -185,25 +294,147 @@ class IntegratedLogicAnalyzer(Elaboratable):
                 delayed_enable = Signal()
                 m.d.sync += delayed_enable.eq(self.enable)
 
-        # Counter that keeps track of our write position.
-        write_position = Signal(range(0, self.sample_depth))
+        enabled = delayed_enable if with_enable else 1
 
-        # Set up our write port to capture the input signals,
-        # and our read port to provide the output.
-        m.d.comb += [
-            write_port.data        .eq(delayed_inputs),
-            write_port.addr        .eq(write_position),
+        # Our synchronizer already provides the first pretrigger sample. Any further
+        # pretrigger samples are kept in sample memory itself: while we're waiting for
+        # a trigger, we keep writing samples into it as a ring buffer.
+        ring_buffer = self.samples_pretrigger >= 2
 
-            self.captured_sample   .eq(read_port.data),
-            read_port.addr         .eq(self.captured_sample_number)
-        ]
+        # Counter that keeps track of our write position.
+        write_position = Signal(range(0, self.buffer_depth))
 
         # Don't sample unless our FSM asserts our sample signal explicitly.
         sampling = Signal()
-        m.d.comb += [
-            write_port.en.eq(sampling),
-            self.sampling.eq(sampling),
-        ]
+        m.d.comb += self.sampling.eq(sampling)
+
+        # Similarly, only record pretrigger samples when our FSM asks for them.
+        prefilling = Signal()
+
+        if self.compressed:
+            # Each memory entry holds a sample, and how often it was repeated
+            # after it was first captured.
+            run_length      = Signal(self.run_length_width)
+            last_sample     = Signal.like(self.inputs)
+            sample_count    = Signal(range(0, self.sample_depth))
+            last_entry      = Signal.like(write_position)
+
+            first_sample    = Signal()
+            repeated        = Signal()
+            entry_position  = Signal.like(write_position)
+            buffer_full     = Signal()
+
+            m.d.comb += [
+                first_sample   .eq(sample_count == 0),
+                repeated       .eq(~first_sample & (delayed_inputs == last_sample) & (run_length != (2 ** self.run_length_width - 1))),
+                entry_position .eq(Mux(first_sample | repeated, write_position, write_position + 1)),
+                buffer_full    .eq(~first_sample & ~repeated & (write_position == (self.buffer_depth - 1))),
+
+                write_data .eq(Cat(delayed_inputs, Mux(repeated, run_length + 1, 0))),
+                write_addr .eq(entry_position),
+                write_en   .eq(sampling & ~buffer_full),
+            ]
+
+            with m.If(write_en):
+                m.d.sync += [
+                    write_position .eq(entry_position),
+                    run_length     .eq(Mux(repeated, run_length + 1, 0)),
+                    last_sample    .eq(delayed_inputs),
+                ]
+        else:
+            m.d.comb += [
+                write_data .eq(delayed_inputs),
+                write_addr .eq(write_position),
+                write_en   .eq(sampling | prefilling),
+            ]
+
+            # In ring buffer mode, our buffer depth is a power of two, so this wraps around for free.
+            with m.If(write_en):
+                m.d.sync += write_position.eq(write_position + 1)
+
+        if ring_buffer:
+            # Count the samples in our ring buffer; up to the pretrigger samples
+            # while we're waiting for a trigger, and up to a full capture afterwards.
+            # Rather than comparing against our pretrigger count all the time,
+            # we latch when we've recorded enough pretrigger samples.
+            pretrigger_fill_counter = Signal(range(self.sample_depth))
+            pretrigger_filled       = Signal()
+
+            # Our read addresses are relative to where the capture we're reading out ended.
+            # When double buffered, we keep writing while it's being read; so we remember that.
+            read_position = Signal.like(write_position)
+            if not self.double_buffered:
+                m.d.comb += read_position.eq(write_position)
+
+        # Set up our read port to provide the output.
+        if self.compressed:
+            # Expand our (sample, repeat count) entries back into individual samples,
+            # moving on to the next sample whenever the requested sample number changes.
+            # read_entry is the entry currently presented by our read port.
+            read_entry      = Signal.like(write_position)
+            read_repeat     = Signal(self.run_length_width)
+            read_run_length = Signal(self.run_length_width)
+            last_number     = Signal.like(self.captured_sample_number)
+
+            next_entry      = Signal.like(read_entry)
+            next_repeat     = Signal.like(read_repeat)
+
+            m.d.comb += [
+                next_entry  .eq(read_entry),
+                next_repeat .eq(read_repeat),
+            ]
+
+            with m.If(self.captured_sample_number == 0):
+                m.d.comb += [
+                    next_entry  .eq(0),
+                    next_repeat .eq(0),
+                ]
+            with m.Elif(self.captured_sample_number != last_number):
+                with m.If(read_repeat != read_run_length):
+                    m.d.comb += next_repeat.eq(read_repeat + 1)
+                # If we've run out of entries, keep repeating the last one.
+                with m.Elif(read_entry != last_entry):
+                    m.d.comb += [
+                        next_entry  .eq(read_entry + 1),
+                        next_repeat .eq(0),
+                    ]
+
+            m.d.sync += [
+                read_entry      .eq(next_entry),
+                read_repeat     .eq(next_repeat),
+                last_number     .eq(self.captured_sample_number),
+            ]
+
+            m.d.comb += [
+                read_run_length      .eq(read_data[self.sample_width:]),
+                self.captured_sample .eq(read_data[:self.sample_width]),
+                read_addr            .eq(next_entry),
+            ]
+        elif ring_buffer:
+            # Once a capture is complete, our first sample is the sample_depth-th sample
+            # before our write position. Our buffer depth is a power of two, so the
+            # address arithmetic wraps around for free.
+            m.d.comb += [
+                self.captured_sample .eq(read_data),
+                read_addr            .eq(read_position - self.sample_depth + self.captured_sample_number),
+            ]
+        else:
+            m.d.comb += [
+                self.captured_sample .eq(read_data),
+                read_addr            .eq(self.captured_sample_number),
+            ]
+
+        # Once a capture has been read out, it can be released.
+        with m.If(self.rearm):
+            m.d.sync += self.complete.eq(0)
+
+        def finish_capture():
+            # When double buffered, the finished capture has to wait until the other buffer is free.
+            if self.double_buffered:
+                m.next = "PENDING"
+            else:
+                m.d.sync += self.complete.eq(1)
+                m.next = "IDLE"
 
         with m.FSM(name="ila_fsm") as fsm:
             m.d.comb += self.capturing.eq(fsm.ongoing("CAPTURE"))
@@ -212,26 +443,83 @@ class IntegratedLogicAnalyzer(Elaboratable):
             with m.State('IDLE'):
                 m.d.comb += sampling.eq(0)
 
-                with m.If(self.trigger):
-                    m.next = 'CAPTURE'
-
-                    # Prepare to capture the first sample
+                # Keep our pretrigger samples coming, unless we're holding
+                # a completed capture that hasn't been read out yet.
+                if ring_buffer:
+                    if self.double_buffered:
+                        m.d.comb += prefilling.eq(enabled)
+                    else:
+                        m.d.comb += prefilling.eq(enabled & ~self.complete)
+
+                    # Count our pretrigger samples by adding the enable in directly, rather than
+                    # gating the counter; and latch our filled flag with a plain OR. Neither
+                    # adds another layer of logic in front of our counter's registers.
                     m.d.sync += [
-                        write_position .eq(0),
-                        self.complete  .eq(0),
+                        pretrigger_fill_counter .eq(pretrigger_fill_counter + (prefilling & ~pretrigger_filled)),
+                        pretrigger_filled       .eq(pretrigger_filled | (prefilling & (pretrigger_fill_counter == (self.samples_pretrigger - 2)))),
                     ]
 
+                # With a ring buffer, only accept a trigger once we've recorded all of our pretrigger
+                # samples; this way, the trigger sample always lands at the same sample number.
+                triggered = (self.trigger & pretrigger_filled) if ring_buffer else self.trigger
+
+                with m.If(triggered):
+                    m.next = 'CAPTURE'
+
+                    # Prepare to capture the first sample. When double buffered,
+                    # the previous capture can keep being read out meanwhile.
+                    if not self.double_buffered:
+                        m.d.sync += self.complete.eq(0)
+                    if not ring_buffer:
+                        m.d.sync += write_position.eq(0)
+
             with m.State('CAPTURE'):
-                enabled = delayed_enable if with_enable else 1
                 m.d.comb += sampling.eq(enabled)
 
-                with m.If(sampling):
-                    m.d.sync += write_position .eq(write_position + 1)
-
-                    # If this is the last sample, we're done. Finish up.
-                    with m.If(write_position == (self.sample_depth - 1)):
-                        m.d.sync += self.complete.eq(1)
-                        m.next = "IDLE"
+                if self.compressed:
+                    with m.If(sampling):
+                        m.d.sync += sample_count.eq(sample_count + 1)
+
+                        # If this is the last sample, or we've run out of buffer, we're done.
+                        with m.If((sample_count == (self.sample_depth - 1)) | buffer_full):
+                            m.d.sync += [
+                                sample_count   .eq(0),
+                                last_entry     .eq(Mux(buffer_full, write_position, entry_position)),
+                            ]
+                            finish_capture()
+
+                elif ring_buffer:
+                    with m.If(sampling):
+                        m.d.sync += pretrigger_fill_counter.eq(pretrigger_fill_counter + 1)
+
+                        # If we've now captured all our samples, we're done. Finish up.
+                        with m.If(pretrigger_fill_counter == (self.sample_depth - 1)):
+                            m.d.sync += [
+                                pretrigger_fill_counter .eq(0),
+                                pretrigger_filled       .eq(0),
+                            ]
+                            finish_capture()
+
+                else:
+                    with m.If(sampling):
+                        # If this is the last sample, we're done. Finish up.
+                        with m.If(write_position == (self.sample_depth - 1)):
+                            finish_capture()
+
+            # PENDING: we're double buffered, and have finished a capture; once the previous
+            # capture has been released, swap buffers so the new one can be read out.
+            if self.double_buffered:
+                with m.State('PENDING'):
+                    m.d.comb += self.other_buffer_draining.eq(self.complete)
+
+                    with m.If(~self.complete):
+                        m.d.sync += [
+                            active_buffer .eq(~active_buffer),
+                            self.complete .eq(1),
+                        ]
+                        if ring_buffer:
+                            m.d.sync += read_position.eq(write_position)
+                        m.next = 'IDLE'
 
         # Convert our sync domain to the domain requested by the user, if necessary.
         if self.domain != "sync":
@@ -246,24 +534,29 @@ class IntegratedLogicAnalyzerTest(GatewareTestCase):
         yield self.input_b .eq(0)
         yield self.input_c .eq(0)
 
+        # We provide new values thousands of times per test; so only build this once.
+        self._all_signals = Cat(self.input_a, self.input_b, self.input_c)
+
     def provide_all_signals(self, value):
-        all_signals = Cat(self.input_a, self.input_b, self.input_c)
-        yield all_signals.eq(value)
+        yield self._all_signals.eq(value)
 
     def assert_sample_value(self, address, value):
         """ Helper that asserts a ILA sample has a given value. """
+        captured_sample = self.dut.captured_sample
 
+        # Our sample memory has a synchronous read port; so give it a cycle to respond.
         yield self.dut.captured_sample_number.eq(address)
         yield
+        yield
 
         try:
-            self.assertEqual((yield self.dut.captured_sample), value)
+            self.assertEqual((yield captured_sample), value)
             return
         except AssertionError:
             pass
 
         # Generate an appropriate exception.
-        actual_value = (yield self.dut.captured_sample)
+        actual_value = (yield captured_sample)
         message = "assertion failed: at address 0x{:08x}: {:08x} != {:08x} (expected)".format(address, actual_value, value)
         raise AssertionError(message)
 
@@ -426,6 +719,284 @@ class IntegratedLogicAnalyzerPretriggerTest(IntegratedLogicAnalyzerTest):
         self.assertEqual((yield self.dut.sampling), 0)
         self.assertEqual((yield self.dut.complete), 1)
 
+    @sync_test_case
+    def test_rearm(self):
+        yield self.dut.enable.eq(1)
+
+        # A trigger that arrives before we've seen all our pretrigger samples should be ignored.
+        yield from self.provide_all_signals(0xDEADBEEF)
+        yield from self.pulse(self.dut.trigger)
+        self.assertEqual((yield self.dut.capturing), 0)
+
+        # Run a first capture, once our pretrigger buffer has filled.
+        yield from self.advance_cycles(2 * self.PRETRIGGER_SAMPLES)
+        yield from self.pulse(self.dut.trigger)
+        yield from self.advance_cycles(40)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Until it's been released, further triggers should be ignored; and our capture kept.
+        yield from self.provide_all_signals(0x0BADF00D)
+        yield from self.pulse(self.dut.trigger)
+        yield from self.advance_cycles(40)
+        self.assertEqual((yield self.dut.complete), 1)
+        yield from self.assert_sample_value(self.PRETRIGGER_SAMPLES, 0xDEADBEEF)
+
+        # Release it, and provide a fresh set of pretrigger samples.
+        yield from self.pulse(self.dut.rearm)
+        self.assertEqual((yield self.dut.complete), 0)
+
+        for i in range(2 * self.PRETRIGGER_SAMPLES):
+            yield from self.provide_all_signals(i)
+            yield
+
+        yield from self.provide_all_signals(0xCAFEBABE)
+        yield from self.pulse(self.dut.trigger)
+        yield from self.advance_cycles(40)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # The samples right before our trigger should have made it into our capture.
+        for n in range(self.PRETRIGGER_SAMPLES):
+            yield from self.assert_sample_value(n, self.PRETRIGGER_SAMPLES + n)
+        yield from self.assert_sample_value(self.PRETRIGGER_SAMPLES, 0xCAFEBABE)
+
+    @sync_test_case
+    def test_early_trigger(self):
+        yield self.dut.enable.eq(1)
+
+        # Hold our trigger while our pretrigger buffer is filling; only once it's full
+        # should a capture start. Our capturing flag lags the sample that triggered it
+        # by a cycle, so our trigger sample is the one before we first see it.
+        yield self.dut.trigger.eq(1)
+        for i in range(2 * self.PRETRIGGER_SAMPLES):
+            yield from self.provide_all_signals(0x100 + i)
+            yield
+
+            if (yield self.dut.capturing):
+                trigger_value = 0x100 + i - 1
+                break
+        yield self.dut.trigger.eq(0)
+
+        self.assertGreater(trigger_value, 0x100 + self.PRETRIGGER_SAMPLES - 1)
+        yield from self.advance_cycles(40)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Our trigger sample should still be at the same place in our capture,
+        # with a full set of pretrigger samples in front of it.
+        for n in range(self.PRETRIGGER_SAMPLES + 1):
+            yield from self.assert_sample_value(n, trigger_value - self.PRETRIGGER_SAMPLES + n)
+
+
+class IntegratedLogicAnalyzerTraceMaskTest(IntegratedLogicAnalyzerTest):
+    def instantiate_dut(self):
+        self.input_a = Signal()
+        self.input_b = Signal(30)
+        self.input_c = Signal()
+        self.input_d = Signal(8)
+
+        # input_d is too detailed for our trace depth, and should be left out.
+        return IntegratedLogicAnalyzer(
+            signals=[self.input_a, self.input_b, self.input_c, self.input_d],
+            trace_levels=[0, 0, 1, 2],
+            trace_depth=1,
+            sample_depth = 8,
+            samples_pretrigger=0,
+            bank_width=16,
+            with_trace_mask=True
+        )
+
+    @sync_test_case
+    def test_sampling(self):
+        self.assertEqual(self.dut.sample_width, 32)
+        self.assertEqual(len(self.dut.banks), 2)
+
+        # Only capture our lower bank.
+        yield self.dut.trace_mask.eq(0b01)
+        yield self.input_d.eq(0xFF)
+
+        yield from self.provide_all_signals(0x12345678)
+        yield from self.pulse(self.dut.trigger, step_after=False)
+        yield from self.advance_cycles(10)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Our upper bank should have kept its previous contents.
+        for address in range(8):
+            yield from self.assert_sample_value(address, 0x00005678)
+
+    def test_trace_level_mismatch(self):
+        # Each signal needs a trace level; otherwise, we can't tell which ones to keep.
+        with self.assertRaises(ValueError):
+            IntegratedLogicAnalyzer(signals=[Signal(), Signal()], trace_levels=[0], trace_depth=0, sample_depth=8)
+
+
+class IntegratedLogicAnalyzerCompressedTest(IntegratedLogicAnalyzerTest):
+    # runs of (value, length); the last run is longer than a single entry can hold
+    RUNS = [(0x11111111, 5), (0x22222222, 1), (0x33333333, 10), (0x44444444, 12), (0x55555555, 1), (0x66666666, 3)]
+
+    def instantiate_dut(self):
+        self.input_a = Signal()
+        self.input_b = Signal(30)
+        self.input_c = Signal()
+
+        return IntegratedLogicAnalyzer(
+            signals=[self.input_a, self.input_b, self.input_c],
+            sample_depth = 32,
+            samples_pretrigger=0,
+            compressed=True,
+            buffer_depth=16,
+            run_length_width=2,
+            bank_width=16,
+            with_trace_mask=True
+        )
+
+    @sync_test_case
+    def test_sampling(self):
+        samples = [value for value, length in self.RUNS for _ in range(length)]
+
+        yield from self.provide_all_signals(0xDEADBEEF)
+        yield from self.advance_cycles(4)
+
+        # Trigger the capture on the first sample.
+        yield from self.provide_all_signals(samples[0])
+        yield from self.pulse(self.dut.trigger, step_after=False)
+
+        for sample in samples[1:]:
+            yield from self.provide_all_signals(sample)
+            yield
+
+        yield from self.advance_cycles(4)
+
+        # We now should be done with our sampling.
+        self.assertEqual((yield self.dut.sampling), 0)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Read our samples back in order; they should be expanded again.
+        for address, sample in enumerate(samples):
+            yield from self.assert_sample_value(address, sample)
+
+        # Restarting the readout should provide the same samples.
+        for address, sample in enumerate(samples[:8]):
+            yield from self.assert_sample_value(address, sample)
+
+    def test_pretrigger_unsupported(self):
+        # A bad configuration should be caught as soon as it's created, rather than when it's built.
+        with self.assertRaises(ValueError):
+            IntegratedLogicAnalyzer(signals=[Signal(8)], sample_depth=32, samples_pretrigger=2, compressed=True)
+
+    @sync_test_case
+    def test_masked_banks(self):
+        samples = [value for value, length in self.RUNS for _ in range(length)]
+
+        # Mask off everything but our lowest bank; including the bank holding our repeat counts.
+        self.assertEqual(len(self.dut.banks), 3)
+        yield self.dut.trace_mask.eq(0b001)
+
+        yield from self.provide_all_signals(samples[0])
+        yield from self.pulse(self.dut.trigger, step_after=False)
+
+        for sample in samples[1:]:
+            yield from self.provide_all_signals(sample)
+            yield
+
+        yield from self.advance_cycles(4)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Our repeat counts should still have been written; so our lower bank should expand correctly.
+        for address, sample in enumerate(samples):
+            yield from self.assert_sample_value(address, sample & 0xFFFF)
+
+
+class IntegratedLogicAnalyzerCompressedAutoWidthTest(IntegratedLogicAnalyzerTest):
+    """ Captures a compressed trace whose repeat counter is sized to the capture. """
+
+    def instantiate_dut(self):
+        self.input_a = Signal()
+        self.input_b = Signal(30)
+        self.input_c = Signal()
+
+        return IntegratedLogicAnalyzer(
+            signals=[self.input_a, self.input_b, self.input_c],
+            sample_depth = 32,
+            samples_pretrigger=0,
+            compressed=True,
+            buffer_depth=1,
+            run_length_width=None
+        )
+
+    @sync_test_case
+    def test_single_run(self):
+        # Our counter should be just wide enough to count off a full capture.
+        self.assertEqual(self.dut.run_length_width, 5)
+
+        # Hold our inputs steady for a whole capture; which should then fit into our single entry,
+        # rather than filling it partway through and cutting our capture short.
+        yield from self.provide_all_signals(0x12345678)
+        yield from self.pulse(self.dut.trigger, step_after=False)
+        yield from self.advance_cycles(24)
+        self.assertEqual((yield self.dut.capturing), 1)
+
+        yield from self.advance_cycles(16)
+
+        self.assertEqual((yield self.dut.complete), 1)
+        for address in range(32):
+            yield from self.assert_sample_value(address, 0x12345678)
+
+
+class IntegratedLogicAnalyzerDoubleBufferedTest(IntegratedLogicAnalyzerTest):
+    PRETRIGGER_SAMPLES = 4
+
+    def instantiate_dut(self):
+        self.input_a = Signal()
+        self.input_b = Signal(30)
+        self.input_c = Signal()
+
+        return IntegratedLogicAnalyzer(
+            signals=[self.input_a, self.input_b, self.input_c],
+            sample_depth = 8,
+            samples_pretrigger=self.PRETRIGGER_SAMPLES,
+            double_buffered=True
+        )
+
+    def capture(self, base, length):
+        """ Helper that triggers on base, and then provides base + 1, base + 2, ... """
+        yield from self.provide_all_signals(base)
+        yield from self.pulse(self.dut.trigger, step_after=False)
+
+        for i in range(1, length):
+            yield from self.provide_all_signals(base + i)
+            yield
+
+    @sync_test_case
+    def test_sampling(self):
+        for i in range(2 * self.PRETRIGGER_SAMPLES):
+            yield from self.provide_all_signals(0x100 + i)
+            yield
+
+        yield from self.capture(0xA00, 8)
+        yield from self.advance_cycles(4)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Start our next capture right away; our first one should still be readable.
+        for i in range(2 * self.PRETRIGGER_SAMPLES):
+            yield from self.provide_all_signals(0x200 + i)
+            yield
+        yield from self.capture(0xB00, 8)
+        yield from self.advance_cycles(4)
+        self.assertEqual((yield self.dut.other_buffer_draining), 1)
+
+        for n in range(self.PRETRIGGER_SAMPLES):
+            yield from self.assert_sample_value(n, 0x104 + n)
+            yield from self.assert_sample_value(self.PRETRIGGER_SAMPLES + n, 0xA00 + n)
+
+        # Once we release our first capture, the second should take its place.
+        yield from self.pulse(self.dut.rearm)
+        yield
+        self.assertEqual((yield self.dut.complete), 1)
+        self.assertEqual((yield self.dut.other_buffer_draining), 0)
+
+        for n in range(self.PRETRIGGER_SAMPLES):
+            yield from self.assert_sample_value(n, 0x204 + n)
+            yield from self.assert_sample_value(self.PRETRIGGER_SAMPLES + n, 0xB00 + n)
+
 
 class SyncSerialILA(Elaboratable):
     """ Super-simple ILA that reads samples out over a simple unidirectional SPI.
@@ -433,13 +1004,16 @@ class SyncSerialILA(Elaboratable):
 
     This protocol is simple: every time CS goes low, we begin sending out a bit of
     sample on each rising edge. Once a new sample is complete, the next sample begins
-    on the next 32-bit boundary.
+    on the next byte boundary.
 
     Attributes
     ----------
     enable: Signal(), input
         This input is only available if `with_enable` is True.
         Only samples with enable high will be captured.
+    trace_mask: Signal(), input
+        This input is only available if `with_trace_mask` is True.
+        Enables writes to each bank of sample memory; see IntegratedLogicAnalyzer.
     trigger: Signal(), input
         A strobe that determines when we should start sampling.
     capturing: Signal(), output
@@ -449,6 +1023,11 @@ class SyncSerialILA(Elaboratable):
         Indicates when data is being written into ILA memory
     complete: Signal(), output
         Indicates when sampling is complete and ready to be read.
+    rearm: Signal(), input
+        A strobe that releases a completed capture; so pretrigger samples for the next
+        capture can be recorded. Captures are released automatically once their last
+        sample has been read out over SPI, so this is only needed to drop a capture
+        that won't be read out in full.
 
     sck: Signal(), input
         Serial clock for the SPI lines.
@@ -484,6 +1063,8 @@ class SyncSerialILA(Elaboratable):
     with_enable: bool
         This provides an 'enable' signal.
         Only samples with enable high will be captured.
+    with_trace_mask: bool
+        This provides a 'trace_mask' signal.
     """
 
     def __init__(self, *, signals, sample_depth, clock_polarity=0, clock_phase=1, cs_idles_high=False, **kwargs):
@@ -513,7 +1094,7 @@ class SyncSerialILA(Elaboratable):
             **kwargs)
 
         # Copy some core parameters from our inner ILA.
-        self.signals       = signals
+        self.signals       = self.ila.signals
         self.sample_width  = self.ila.sample_width
         self.sample_depth  = self.ila.sample_depth
         self.sample_rate   = self.ila.sample_rate
@@ -521,24 +1102,22 @@ class SyncSerialILA(Elaboratable):
 
         if kwargs.get('with_enable'):
             self.enable = self.ila.enable
+        if kwargs.get('with_trace_mask'):
+            self.trace_mask = self.ila.trace_mask
 
         # Figure out how many bytes we'll send per sample.
-        # We'll always send things squished into 32-bit chunks, as this is what the SPI engine
-        # on our Debug Controller likes most.
-        words_per_sample = (self.ila.sample_width + 31) // 32
-
-        # Bolster our bits_per_word up to a power of two...
-        self.bits_per_sample = words_per_sample * 4 * 8
-        self.bits_per_sample = 2 ** ((self.bits_per_sample - 1).bit_length())
-
-        # ... and compute how many bits should be used.
-        self.bytes_per_sample = self.bits_per_sample // 8
+        # Samples are only padded up to the next byte boundary; padding them to
+        # a power of two would nearly double the readout time for sample widths
+        # just above a power of two.
+        self.bytes_per_sample = (self.ila.sample_width + 7) // 8
+        self.bits_per_sample  = self.bytes_per_sample * 8
 
         # Expose our ILA's trigger and status ports directly.
         self.trigger   = self.ila.trigger
         self.capturing = self.ila.capturing
         self.sampling  = self.ila.sampling
         self.complete  = self.ila.complete
+        self.rearm     = Signal()
 
 
     def elaborate(self, platform):
@@ -586,6 +1165,11 @@ class SyncSerialILA(Elaboratable):
             self.ila.captured_sample_number .eq(current_sample_number)
         ]
 
+        # Once our last sample has been latched in for sending, our capture has been read out;
+        # so release it, and let our ILA record pretrigger samples for the next one.
+        last_sample_latched = self.spi.cs & interface.word_accepted & (current_sample_number == (self.ila.sample_depth - 1))
+        m.d.comb += self.ila.rearm.eq(self.rearm | last_sample_latched)
+
         # Convert our sync domain to the domain requested by the user, if necessary.
         if self.domain != "sync":
             m = DomainRenamer({"sync": self.domain})(m)
@@ -600,6 +1184,7 @@ class SyncSerialReadoutILATest(SPIGatewareTestCase):
         return SyncSerialILA(
             signals=[self.input_signal],
             sample_depth=16,
+            samples_pretrigger=0,
             clock_polarity=1,
             clock_phase=0
         )
@@ -628,7 +1213,7 @@ class SyncSerialReadoutILATest(SPIGatewareTestCase):
         # We'll test reading them out.
         self.assertEqual((yield self.dut.complete), 1)
 
-        # Start the transaction, and exchange 16 bytes of data.
+        # Start the transaction, and exchange 32 bytes of data.
         yield self.dut.spi.cs.eq(1)
         yield
 
@@ -636,18 +1221,65 @@ class SyncSerialReadoutILATest(SPIGatewareTestCase):
         data = yield from self.spi_exchange_data(b"\0" * 32)
 
         # ... and ensure it matches what was sampled.
+        # Our 12-bit samples are padded to two bytes each.
         i = 0
         while data:
-            datum = data[0:4]
-            del data[0:4]
+            datum = data[0:2]
+            del data[0:2]
 
-            expected = b"\x00\x00\x0f" + bytes([i])
+            expected = b"\x0f" + bytes([i])
             self.assertEqual(datum, expected)
             i += 1
 
 
 
 
+class SyncSerialPretriggerReadoutILATest(SPIGatewareTestCase):
+    PRETRIGGER_SAMPLES = 4
+
+    def instantiate_dut(self):
+        self.input_signal = Signal(12)
+        return SyncSerialILA(
+            signals=[self.input_signal],
+            sample_depth=16,
+            samples_pretrigger=self.PRETRIGGER_SAMPLES,
+            clock_polarity=1,
+            clock_phase=0
+        )
+
+    def initialize_signals(self):
+        yield self.input_signal.eq(0)
+
+    def capture_and_read_out(self, first_value):
+        """ Runs a capture of a counting signal, triggered on first_value; and returns its samples. """
+
+        # Count up, triggering at first_value.
+        for i in range(first_value - 2 * self.PRETRIGGER_SAMPLES, first_value + 20):
+            yield self.input_signal.eq(i)
+            yield self.dut.trigger.eq(i == first_value)
+            yield
+
+        yield from self.advance_cycles(5)
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Read out a full capture; our 12-bit samples are padded to two bytes each.
+        data = yield from self.spi_exchange_data(b"\0" * 32)
+        return [int.from_bytes(data[i:i + 2], byteorder='big') for i in range(0, len(data), 2)]
+
+    @sync_test_case
+    def test_repeated_captures(self):
+
+        # Run two captures back to back, without ever releasing them ourselves.
+        # Each should have its trigger sample at the same place.
+        for first_value in (0x100, 0x200):
+            samples = yield from self.capture_and_read_out(first_value)
+            self.assertEqual(samples, list(range(first_value - self.PRETRIGGER_SAMPLES, first_value + 16 - self.PRETRIGGER_SAMPLES)))
+
+            # Reading out our capture should have released it.
+            yield
+            self.assertEqual((yield self.dut.complete), 0)
+
+
 class StreamILA(Elaboratable):
     """ Super-simple ILA that outputs its samples over a Stream.
     Create a receiver for this object by calling apollo.ila_receiver_for(<this>).
@@ -660,6 +1292,9 @@ class StreamILA(Elaboratable):
     enable: Signal(), input
         This input is only available if `with_enable` is True.
         Only samples with enable high will be captured.
+    trace_mask: Signal(), input
+        This input is only available if `with_trace_mask` is True.
+        Enables writes to each bank of sample memory; see IntegratedLogicAnalyzer.
     trigger: Signal(), input
         A strobe that determines when we should start sampling.
     capturing: Signal(), output
@@ -685,6 +1320,17 @@ class StreamILA(Elaboratable):
     o_domain: string
         The clock domain in which the output stream will be generated.
         If omitted, defaults to the same domain as the core ILA.
+    o_domain_synchronous: bool
+        If True, the output domain's clock is assumed to be derived from the same source
+        as the ILA's clock (e.g. an integer division of it), so the two domains can see each
+        other's registers directly. We then cross our stream over with a single handshake
+        register rather than an asynchronous FIFO.
+    cdc_fifo_depth: int
+        The depth of the asynchronous FIFO that carries our stream into the output domain.
+        Its Gray-coded pointers need a power-of-two depth, so this is rounded up to the next
+        power of two; e.g. a depth of 100 becomes 128. A deep FIFO lets us keep streaming
+        while the output domain is briefly unable to accept samples; and a block RAM holds
+        a few hundred samples for the same cost as a few dozen.
     samples_pretrigger: int
         The number of our samples which should be captured _before_ the trigger.
         This also can act like an implicit synchronizer; so asynchronous inputs
@@ -693,9 +1339,11 @@ class StreamILA(Elaboratable):
     with_enable: bool
         This provides an 'enable' signal.
         Only samples with enable high will be captured.
+    with_trace_mask: bool
+        This provides a 'trace_mask' signal.
     """
 
-    def __init__(self, *, signals, sample_depth, o_domain=None, **kwargs):
+    def __init__(self, *, signals, sample_depth, o_domain=None, o_domain_synchronous=False, cdc_fifo_depth=64, **kwargs):
         # Extract the domain from our keyword arguments, and then translate it to sync
         # before we pass it back below. We'll use a DomainRenamer at the boundary to
         # handle non-sync domains.
@@ -703,6 +1351,8 @@ class StreamILA(Elaboratable):
         kwargs['domain'] = 'sync'
 
         self._o_domain = o_domain if o_domain else self.domain
+        self._o_domain_synchronous = o_domain_synchronous
+        self._cdc_fifo_depth       = 2 ** (cdc_fifo_depth - 1).bit_length()
 
         # Create our core integrated logic analyzer.
         self.ila = IntegratedLogicAnalyzer(
@@ -711,7 +1361,7 @@ class StreamILA(Elaboratable):
             **kwargs)
 
         # Copy some core parameters from our inner ILA.
-        self.signals       = signals
+        self.signals       = self.ila.signals
         self.sample_width  = self.ila.sample_width
         self.sample_depth  = self.ila.sample_depth
         self.sample_rate   = self.ila.sample_rate
@@ -719,10 +1369,12 @@ class StreamILA(Elaboratable):
 
         if kwargs.get('with_enable'):
             self.enable = self.ila.enable
+        if kwargs.get('with_trace_mask'):
+            self.trace_mask = self.ila.trace_mask
 
-        # Bolster our bits per sample "word" up to a power of two.
-        self.bits_per_sample = 2 ** ((self.ila.sample_width - 1).bit_length())
-        self.bytes_per_sample = self.bits_per_sample // 8
+        # Pad our sample "word" up to the next byte boundary.
+        self.bytes_per_sample = (self.ila.sample_width + 7) // 8
+        self.bits_per_sample  = self.bytes_per_sample * 8
 
         #
         # I/O port
@@ -740,6 +1392,9 @@ class StreamILA(Elaboratable):
         m  = Module()
         m.submodules.ila = ila = self.ila
 
+        # If we're streaming out of the domain we're capturing from, we drive our output stream
+        # directly; there's no need for an intermediate stream, or for any wiring between the two.
+        # Otherwise, we'll build our stream in our own domain, and carry it across below.
         if self._o_domain == self.domain:
             in_domain_stream = self.stream
         else:
@@ -747,13 +1402,17 @@ class StreamILA(Elaboratable):
 
         # Count where we are in the current transmission.
         current_sample_number = Signal(range(0, ila.sample_depth))
+        next_sample_number    = Signal.like(current_sample_number)
 
-        # Always present the current sample number to our ILA, and the current
-        # sample value to the UART.
+        # Our ILA's samples become available one cycle after they're addressed;
+        # so we always present the _next_ sample number to our ILA, which leaves
+        # the current sample value ready for the UART.
         m.d.comb += [
-            ila.captured_sample_number  .eq(current_sample_number),
+            next_sample_number          .eq(current_sample_number),
+            ila.captured_sample_number  .eq(next_sample_number),
             in_domain_stream.payload    .eq(ila.captured_sample)
         ]
+        m.d.sync += current_sample_number.eq(next_sample_number)
 
         with m.FSM():
 
@@ -763,8 +1422,9 @@ class StreamILA(Elaboratable):
                 # Always allow triggering, as we're ready for the data.
                 m.d.comb += self.ila.trigger.eq(self.trigger)
 
-                # Once we're triggered, move onto the SAMPLING state.
-                with m.If(self.trigger):
+                # Once our ILA has accepted a trigger, move onto the SAMPLING state. Our ILA can ignore
+                # triggers while it's still recording pretrigger samples; so we wait for it to start capturing.
+                with m.If(self.ila.capturing):
                     m.next = "SAMPLING"
 
 
@@ -775,10 +1435,8 @@ class StreamILA(Elaboratable):
 
                 # Once our ILA has finished sampling, prepare to read out our samples.
                 with m.If(self.ila.complete):
-                    m.d.sync += [
-                        current_sample_number  .eq(0),
-                        in_domain_stream.first      .eq(1)
-                    ]
+                    m.d.comb += next_sample_number.eq(0)
+                    m.d.sync += in_domain_stream.first.eq(1)
                     m.next = "SENDING"
 
 
@@ -795,49 +1453,103 @@ class StreamILA(Elaboratable):
 
                 # Each time the UART accepts a valid word, move on to the next one.
                 with m.If(in_domain_stream.ready):
-                    m.d.sync += [
-                        current_sample_number .eq(current_sample_number + 1),
-                        in_domain_stream.first     .eq(0)
-                    ]
+                    m.d.comb += next_sample_number.eq(current_sample_number + 1)
+                    m.d.sync += in_domain_stream.first.eq(0)
 
-                    # If this was the last sample, we're done! Move back to idle.
-                    with m.If(self.stream.last):
+                    # If this was the last sample, we're done! Release our capture,
+                    # so the ILA can record pretrigger samples again, and move back to idle.
+                    with m.If(in_domain_stream.last):
+                        m.d.comb += ila.rearm.eq(1)
                         m.next = "IDLE"
 
 
         # If we're not streaming out of the same domain we're capturing from,
         # we'll add some clock-domain crossing hardware.
         if self._o_domain != self.domain:
-            in_domain_signals  = Cat(
-                in_domain_stream.first,
-                in_domain_stream.payload,
-                in_domain_stream.last
-            )
-            out_domain_signals = Cat(
-                self.stream.first,
-                self.stream.payload,
-                self.stream.last
-            )
-
-            # Create our async FIFO...
-            m.submodules.cdc = fifo = AsyncFIFOBuffered(
-                width=len(in_domain_signals),
-                depth=16,
-                w_domain="sync",
-                r_domain=self._o_domain
-            )
 
-            m.d.comb += [
-                # ... fill it from our in-domain stream...
-                fifo.w_data             .eq(in_domain_signals),
-                fifo.w_en               .eq(in_domain_stream.valid),
-                in_domain_stream.ready  .eq(fifo.w_rdy),
-
-                # ... and output it into our outupt stream.
-                out_domain_signals      .eq(fifo.r_data),
-                self.stream.valid       .eq(fifo.r_rdy),
-                fifo.r_en               .eq(self.stream.ready)
-            ]
+            # If our clocks are related, each domain can safely look at the other's registers;
+            # so a single holding register, handed back and forth by a pair of toggles, is enough.
+            # It's only a register, so it carries our framing right alongside each sample.
+            if self._o_domain_synchronous:
+                in_domain_signals  = Cat(
+                    in_domain_stream.first,
+                    in_domain_stream.payload,
+                    in_domain_stream.last
+                )
+                out_domain_signals = Cat(
+                    self.stream.first,
+                    self.stream.payload,
+                    self.stream.last
+                )
+
+                handoff     = Signal.like(in_domain_signals)
+                request     = Signal()
+                acknowledge = Signal()
+
+                m.d.comb += [
+                    # We can accept a new word whenever the output domain has taken the last one...
+                    in_domain_stream.ready  .eq(request == acknowledge),
+
+                    # ... and we have a word for the output domain whenever it hasn't.
+                    out_domain_signals      .eq(handoff),
+                    self.stream.valid       .eq(request != acknowledge),
+                ]
+
+                with m.If(in_domain_stream.valid & in_domain_stream.ready):
+                    m.d.sync += [
+                        handoff  .eq(in_domain_signals),
+                        request  .eq(~request),
+                    ]
+
+                with m.If(self.stream.valid & self.stream.ready):
+                    m.d[self._o_domain] += acknowledge.eq(~acknowledge)
+
+            # Otherwise, create an async FIFO that carries just our payload, so it stays exactly as wide as
+            # our samples, and packs neatly into block RAM. Our framing travels through a tiny sideband FIFO,
+            # which gets one tag at the start of each packet: the first sample's value of last, which is only
+            # ever set for single-sample captures. The output side counts off the rest of each packet from there.
+            else:
+                m.submodules.cdc = fifo = AsyncFIFOBuffered(
+                    width=len(in_domain_stream.payload),
+                    depth=self._cdc_fifo_depth,
+                    w_domain="sync",
+                    r_domain=self._o_domain
+                )
+                m.submodules.cdc_tags = tag_fifo = AsyncFIFO(
+                    width=1,
+                    depth=2,
+                    w_domain="sync",
+                    r_domain=self._o_domain
+                )
+
+                # The first sample of each packet must go into both FIFOs at once; others only need our data FIFO.
+                data_writable = ~in_domain_stream.first | tag_fifo.w_rdy
+                tag_writable  = fifo.w_rdy
+
+                # Count how many samples of the current packet are still to come after the one we're presenting;
+                # when there are none, we're presenting the first sample of a new packet.
+                samples_remaining = Signal(range(0, self.sample_depth))
+                starting_packet   = (samples_remaining == 0)
+
+                m.d.comb += [
+                    # ... fill our FIFOs from our in-domain stream...
+                    fifo.w_data             .eq(in_domain_stream.payload),
+                    fifo.w_en               .eq(in_domain_stream.valid & data_writable),
+                    tag_fifo.w_data         .eq(in_domain_stream.last),
+                    tag_fifo.w_en           .eq(in_domain_stream.valid & in_domain_stream.first & tag_writable),
+                    in_domain_stream.ready  .eq(fifo.w_rdy & data_writable),
+
+                    # ... and output them into our output stream. A packet only starts once its tag has arrived.
+                    self.stream.payload     .eq(fifo.r_data),
+                    self.stream.first       .eq(starting_packet),
+                    self.stream.last        .eq(Mux(starting_packet, tag_fifo.r_data, samples_remaining == 1)),
+                    self.stream.valid       .eq(fifo.r_rdy & (~starting_packet | tag_fifo.r_rdy)),
+                    fifo.r_en               .eq(self.stream.valid & self.stream.ready),
+                    tag_fifo.r_en           .eq(self.stream.valid & self.stream.ready & starting_packet),
+                ]
+
+                with m.If(self.stream.valid & self.stream.ready):
+                    m.d[self._o_domain] += samples_remaining.eq(Mux(starting_packet, self.sample_depth - 1, samples_remaining - 1))
 
         # Convert our sync domain to the domain requested by the user, if necessary.
         if self.domain != "sync":
@@ -847,6 +1559,148 @@ class StreamILA(Elaboratable):
 
 
 
+class StreamILATest(GatewareTestCase):
+    """ Reads captures out of a StreamILA through its asynchronous FIFO, into a slower output domain. """
+
+    # Our output domain runs at a quarter of our ILA's rate.
+    OUT_CLOCK_FREQUENCY = 25e6
+    SAMPLE_DEPTH        = 16
+    PRETRIGGER_SAMPLES  = 4
+    STREAM_ARGUMENTS    = {}
+
+    def instantiate_dut(self):
+        self.input_signal = Signal(12)
+        return StreamILA(
+            signals=[self.input_signal],
+            sample_depth=self.SAMPLE_DEPTH,
+            samples_pretrigger=self.PRETRIGGER_SAMPLES,
+            o_domain="out",
+            **self.STREAM_ARGUMENTS
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.sim.add_clock(1 / self.OUT_CLOCK_FREQUENCY, domain="out")
+
+        # Collect everything our ILA streams out, as (payload, first, last, cycle).
+        self.received = []
+        self.sim.add_sync_process(self.receive_samples, domain="out")
+
+    def initialize_signals(self):
+        yield self.input_signal.eq(0)
+
+    def output_ready(self, cycle):
+        """ Returns whether our output domain accepts samples on a given cycle. """
+
+        # Only accept samples on two cycles of every three, so our crossing has to hold onto them.
+        return (cycle % 3) != 0
+
+    def receive_samples(self):
+        yield Passive()
+
+        cycle = 0
+        while True:
+            yield self.dut.stream.ready.eq(self.output_ready(cycle))
+            yield
+
+            if (yield self.dut.stream.valid) and (yield self.dut.stream.ready):
+                self.received.append((
+                    (yield self.dut.stream.payload),
+                    (yield self.dut.stream.first),
+                    (yield self.dut.stream.last),
+                    cycle
+                ))
+
+            cycle += 1
+
+    def run_capture(self, trigger_value):
+        """ Counts up on our input signal, triggering once it reaches trigger_value; and waits for the readout. """
+
+        for value in range(trigger_value - 2 * self.PRETRIGGER_SAMPLES, trigger_value + 20):
+            yield self.input_signal.eq(value)
+            yield self.dut.trigger.eq(value == trigger_value)
+            yield
+
+        yield from self.advance_cycles(200)
+
+    def assert_packet(self, packet, trigger_value):
+        """ Checks that a packet carries a full, framed capture triggered on trigger_value. """
+
+        depth       = self.SAMPLE_DEPTH
+        first_value = trigger_value - self.PRETRIGGER_SAMPLES
+        self.assertEqual([payload for payload, _, _, _ in packet], list(range(first_value, first_value + depth)))
+        self.assertEqual([first for _, first, _, _ in packet], [1] + [0] * (depth - 1))
+        self.assertEqual([last for _, _, last, _ in packet], [0] * (depth - 1) + [1])
+
+    @sync_test_case
+    def test_readout(self):
+
+        # Run two captures back to back; each should arrive in full, framed by first and last.
+        for trigger_value in (0x100, 0x200):
+            yield from self.run_capture(trigger_value)
+
+        depth = self.SAMPLE_DEPTH
+        self.assertEqual(len(self.received), 2 * depth)
+        self.assert_packet(self.received[:depth], 0x100)
+        self.assert_packet(self.received[depth:], 0x200)
+
+
+class StreamILASynchronousTest(StreamILATest):
+    """ Reads captures out of a StreamILA through its handshake register, into a related output domain. """
+
+    STREAM_ARGUMENTS = dict(o_domain_synchronous=True)
+
+    def output_ready(self, cycle):
+        return True
+
+    @sync_test_case
+    def test_throughput(self):
+        yield from self.run_capture(0x100)
+        self.assert_packet(self.received, 0x100)
+
+        # With our output always ready, we should move one sample on every output cycle.
+        cycles = [cycle for _, _, _, cycle in self.received]
+        self.assertEqual(cycles, list(range(cycles[0], cycles[0] + 16)))
+
+
+class StreamILASingleSampleTest(StreamILATest):
+    """ Reads single-sample captures out of a StreamILA, each of which is both the first and last of its packet. """
+
+    SAMPLE_DEPTH       = 1
+    PRETRIGGER_SAMPLES = 0
+
+
+class StreamILAShallowFIFOTest(StreamILATest):
+    """ Reads captures out of a StreamILA whose asynchronous FIFO is too shallow to hold a full capture. """
+
+    STREAM_ARGUMENTS = dict(cdc_fifo_depth=5)
+
+    def setUp(self):
+        super().setUp()
+        self.output_stalled = False
+
+    def output_ready(self, cycle):
+        return not self.output_stalled
+
+    @sync_test_case
+    def test_shallow_fifo(self):
+        # Our FIFO depth should have been rounded up to a power of two.
+        self.assertEqual(self.dut._cdc_fifo_depth, 8)
+
+        # With our output stalled, our FIFO fills up before our capture has been sent;
+        # so our capture shouldn't be released yet.
+        self.output_stalled = True
+        yield from self.run_capture(0x100)
+        self.assertEqual(self.received, [])
+        self.assertEqual((yield self.dut.complete), 1)
+
+        # Once our output is ready, the rest of our capture should follow, intact.
+        self.output_stalled = False
+        yield from self.advance_cycles(200)
+        self.assert_packet(self.received, 0x100)
+        self.assertEqual((yield self.dut.complete), 0)
+
+
 class AsyncSerialILA(Elaboratable):
     """ Super-simple ILA that reads samples out over a UART connection.
     Create a receiver for this object by calling apollo_fpga.ila_receiver_for(<this>).
@@ -859,6 +1713,9 @@ class AsyncSerialILA(Elaboratable):
     enable: Signal(), input
         This input is only available if `with_enable` is True.
         Only samples with enable high will be captured.
+    trace_mask: Signal(), input
+        This input is only available if `with_trace_mask` is True.
+        Enables writes to each bank of sample memory; see IntegratedLogicAnalyzer.
     trigger: Signal(), input
         A strobe that determines when we should start sampling.
     capturing: Signal(), output
@@ -881,6 +1738,10 @@ class AsyncSerialILA(Elaboratable):
 
     divisor: int
         The number of `sync` clock cycles per bit period.
+    tx_fifo_depth: int
+        The depth of the FIFO between our sample buffer and our UART, in samples.
+        Our samples are read out into this FIFO at full speed; so the sample buffer is
+        released for the next capture that much sooner. Set to 0 to omit the FIFO.
 
     domain: string
         The clock domain in which the ILA should operate.
@@ -892,10 +1753,13 @@ class AsyncSerialILA(Elaboratable):
     with_enable: bool
         This provides an 'enable' signal.
         Only samples with enable high will be captured.
+    with_trace_mask: bool
+        This provides a 'trace_mask' signal.
     """
 
-    def __init__(self, *, signals, sample_depth, divisor, **kwargs):
-        self.divisor = divisor
+    def __init__(self, *, signals, sample_depth, divisor, tx_fifo_depth=256, **kwargs):
+        self.divisor        = divisor
+        self._tx_fifo_depth = tx_fifo_depth
 
         #
         # I/O port
@@ -915,7 +1779,7 @@ class AsyncSerialILA(Elaboratable):
             **kwargs)
 
         # Copy some core parameters from our inner ILA.
-        self.signals          = signals
+        self.signals          = self.ila.signals
         self.sample_width     = self.ila.sample_width
         self.sample_depth     = self.ila.sample_depth
         self.sample_rate      = self.ila.sample_rate
@@ -925,6 +1789,8 @@ class AsyncSerialILA(Elaboratable):
 
         if kwargs.get('with_enable'):
             self.enable = self.ila.enable
+        if kwargs.get('with_trace_mask'):
+            self.trace_mask = self.ila.trace_mask
 
         # Expose our ILA's trigger and status ports directly.
         self.trigger   = self.ila.trigger
@@ -942,10 +1808,17 @@ class AsyncSerialILA(Elaboratable):
             byte_width=self.bytes_per_sample,
             divisor=self.divisor
         )
-        m.d.comb +=[
-            uart.stream  .stream_eq(ila.stream),
-            self.tx      .eq(uart.tx)
-        ]
+        m.d.comb += self.tx.eq(uart.tx)
+
+        # If we have one, buffer our samples on their way to the UART, which is much slower than our ILA.
+        if self._tx_fifo_depth:
+            m.submodules.tx_fifo = tx_fifo = SyncFIFOBuffered(width=self.bits_per_sample, depth=self._tx_fifo_depth)
+            m.d.comb += [
+                connect_stream_to_fifo(ila.stream, tx_fifo),
+                connect_fifo_to_stream(tx_fifo, uart.stream),
+            ]
+        else:
+            m.d.comb += uart.stream.stream_eq(ila.stream)
 
 
         # Convert our sync domain to the domain requested by the user, if necessary.
@@ -954,6 +1827,77 @@ class AsyncSerialILA(Elaboratable):
 
         return m
 
+class AsyncSerialILATest(GatewareTestCase):
+    """ Streams a capture out of an AsyncSerialILA, through its transmit FIFO, and decodes it off the UART line. """
+
+    DIVISOR       = 4
+    TX_FIFO_DEPTH = 16
+
+    def instantiate_dut(self):
+        self.input_signal = Signal(16)
+        return AsyncSerialILA(
+            signals=[self.input_signal],
+            sample_depth=8,
+            divisor=self.DIVISOR,
+            samples_pretrigger=0,
+            tx_fifo_depth=self.TX_FIFO_DEPTH
+        )
+
+    def setUp(self):
+        super().setUp()
+
+        # Decode every byte sent on our UART line.
+        self.received = []
+        self.sim.add_sync_process(self.receive_bytes)
+
+    def initialize_signals(self):
+        yield self.input_signal.eq(0)
+
+    def receive_bytes(self):
+        yield Passive()
+
+        while True:
+            yield
+
+            # Once we see a start bit, sample each of our data bits in the middle of its bit period.
+            if (yield self.dut.tx) == 0:
+                yield from self.advance_cycles(self.DIVISOR // 2)
+
+                byte = 0
+                for bit in range(8):
+                    yield from self.advance_cycles(self.DIVISOR)
+                    byte |= (yield self.dut.tx) << bit
+
+                # Skip over our stop bit.
+                yield from self.advance_cycles(self.DIVISOR)
+                self.received.append(byte)
+
+    @sync_test_case
+    def test_readout(self):
+        yield self.input_signal.eq(0x1100)
+        yield from self.pulse(self.dut.trigger, step_after=False)
+
+        for i in range(1, 12):
+            yield self.input_signal.eq(0x1100 + i)
+            yield
+
+        # With a transmit FIFO, our whole capture fits into it; so it should be released long
+        # before our UART has finished sending it. Without one, it's held until it's been sent.
+        yield from self.advance_cycles(20)
+        self.assertEqual((yield self.dut.complete), 0 if self.TX_FIFO_DEPTH else 1)
+
+        # Each of our samples should arrive in order, least significant byte first.
+        yield from self.advance_cycles(1000)
+        expected = b"".join((0x1100 + i).to_bytes(2, byteorder='little') for i in range(8))
+        self.assertEqual(bytes(self.received), expected)
+
+
+class AsyncSerialILAUnbufferedTest(AsyncSerialILATest):
+    """ Streams a capture out of an AsyncSerialILA without a transmit FIFO. """
+
+    TX_FIFO_DEPTH = 0
+
+
 class ILACoreParameters:
     """ This Class is needed to pickle the core parameters of an ILA.
         This makes it possible to run the frontend in a different python script
@@ -968,72 +1912,183 @@ class ILACoreParameters:
         self.bytes_per_sample = ila.bytes_per_sample
 
     def pickle(self, filename="ila.P"):
-        pickle.dump(self, open(filename, "wb"))
+        with open(filename, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     @staticmethod
     def unpickle(filename="ila.P"):
-        ila_core_parameters = pickle.load(open(filename, "rb"))
-        return ILACoreParameters(ila_core_parameters)
+        with open(filename, "rb") as f:
+            return pickle.load(f)
 
 class ILAFrontend(metaclass=ABCMeta):
     """ Class that communicates with an ILA module and emits useful output. """
 
+    # The number of value changes we format into each chunk of VCD text we write out.
+    VCD_CHUNK_SAMPLES = 1 << 16
+
+    # The size of the write buffer for our VCD files; our VCD header is written in many tiny writes.
+    VCD_BUFFER_SIZE = 1 << 20
+
     def __init__(self, ila):
         """
         Parameters:
             ila -- The ILA object to work with.
         """
         self.ila = ila
-        self.samples = None
+
+        # Precompute our signals' names and widths, and where each sits within a sample, as (name, offset, width).
+        self._signal_names  = [signal.name for signal in ila.signals]
+        self._signal_info   = [(signal.name, len(signal)) for signal in ila.signals]
+        self._signal_layout = []
+
+        offset = 0
+        for name, width in self._signal_info:
+            self._signal_layout.append((name, offset, width))
+            offset += width
 
 
     @abstractmethod
     def _read_samples(self):
-        """ Read samples from the target ILA. Should return an iterable of samples. """
+        """ Read samples from the target ILA. Should return an iterable of samples, each as an integer. """
+
+
+    def _read_raw_samples(self):
+        """ Reads samples from the target ILA; and returns them as one big-endian, bytes_per_sample word per sample. """
+        bytes_per_sample = self.ila.bytes_per_sample
+        return b"".join(int(sample).to_bytes(bytes_per_sample, byteorder='big') for sample in self._read_samples())
+
 
+    def _parse_samples_bulk(self, raw_samples):
+        """ Converts the raw binary of a set of samples to a dictionary of name -> array of values, all at once.
 
-    def _parse_sample(self, raw_sample):
-        """ Converts a single binary sample to a dictionary of names -> sample values. """
+        Signals of up to 64 bits are returned as uint64 arrays; wider signals as arrays of Python ints.
+        """
+
+        # View our samples as a (samples, bytes_per_sample) array; dropping any incomplete sample at the end.
+        bytes_per_sample = self.ila.bytes_per_sample
+        raw_samples      = np.frombuffer(raw_samples, dtype=np.uint8)
+        raw_samples      = raw_samples[:len(raw_samples) - len(raw_samples) % bytes_per_sample].reshape(-1, bytes_per_sample)
+
+        columns = []
+
+        # If our samples fit into a machine word, we can shift and mask each signal out of them directly...
+        if self.ila.sample_width <= 64:
+            words = np.zeros((len(raw_samples), 8), dtype=np.uint8)
+            words[:, 8 - bytes_per_sample:] = raw_samples
+            words = words.view('>u8').ravel()
+
+            for _, offset, width in self._signal_layout:
+                columns.append((words >> np.uint64(offset)) & np.uint64((1 << width) - 1))
+
+        # ... otherwise, we decode each sample into a single Python int, and shift and mask each signal out of that.
+        # This is still much cheaper than splitting our samples up bit by bit.
+        else:
+            values    = [[] for _ in self._signal_layout]
+            unpackers = [(column.append, offset, (1 << width) - 1) for column, (_, offset, width) in zip(values, self._signal_layout)]
+            from_bytes = int.from_bytes
 
-        position = 0
-        sample   = {}
+            for raw_sample, in struct.iter_unpack(f'{bytes_per_sample}s', raw_samples):
+                word = from_bytes(raw_sample, 'big')
 
-        # Split our raw, bits(0) signal into smaller slices, and associate them with their names.
-        for signal in self.ila.signals:
-            signal_width = len(signal)
-            signal_bits  = raw_sample[position : position + signal_width]
-            position += signal_width
+                for append, offset, mask in unpackers:
+                    append((word >> offset) & mask)
 
-            sample[signal.name] = signal_bits
+            for column, (_, _, width) in zip(values, self._signal_layout):
+                columns.append(np.array(column, dtype=np.uint64 if width <= 64 else object))
 
-        return sample
+        return {name: column for (name, _, _), column in zip(self._signal_layout, columns)}
 
 
-    def _parse_samples(self, raw_samples):
-        """ Converts raw, binary samples to dictionaries of name -> sample. """
-        return [self._parse_sample(sample) for sample in raw_samples]
+    # The properties that cache our samples, in their various forms; see invalidate().
+    _SAMPLE_CACHES = ('_raw_samples', 'samples_soa', 'timestamps', 'samples')
+
+    def _set_raw_samples(self, raw_samples):
+        """ Replaces our samples with the given raw binary samples. """
+        self.invalidate()
+        self._raw_samples = raw_samples
+
+
+    def invalidate(self):
+        """ Discards our samples; the next time they're needed, a fresh set is fetched from the ILA. """
+        for name in self._SAMPLE_CACHES:
+            self.__dict__.pop(name, None)
 
 
     def refresh(self):
         """ Fetches the latest set of samples from the target ILA. """
-        self.samples = self._parse_samples(self._read_samples())
+        self._set_raw_samples(self._read_raw_samples())
 
 
-    def enumerate_samples(self):
-        """ Returns an iterator that returns pairs of (timestamp, sample). """
+    @cached_property
+    def _raw_samples(self):
+        """ The raw binary of our samples; fetched from the ILA the first time they're needed. """
+        return self._read_raw_samples()
+
 
-        # If we don't have any samples, fetch samples from the ILA.
-        if self.samples is None:
-            self.refresh()
+    @cached_property
+    def samples_soa(self):
+        """ Our samples, as a dictionary of name -> array of values; one column of values per signal.
 
-        timestamp = 0
+        Signals of up to 64 bits are held in uint64 arrays; wider signals in arrays of Python ints.
+        """
+        return self._parse_samples_bulk(self._raw_samples)
 
-        # Iterate over each sample...
-        for sample in self.samples:
-            yield timestamp, sample
 
-            # ... and advance the timestamp by the relevant interval.
-            timestamp += self.ila.sample_period
+    @cached_property
+    def timestamps(self):
+        """ An array of the time at which each of our samples was taken, in seconds. """
+
+        # Accumulate our timestamps one sample period at a time, rather than multiplying them out;
+        # this keeps them identical to the ones we've always generated.
+        sample_count   = memoryview(self._raw_samples).nbytes // self.ila.bytes_per_sample
+        sample_periods = np.full(max(sample_count - 1, 0), self.ila.sample_period)
+        return np.cumsum(np.concatenate(([0.0], sample_periods)))[:sample_count]
+
+
+    @cached_property
+    def samples(self):
+        """ Our samples, as a list of dictionaries of name -> integer value.
+
+        This is built from samples_soa the first time it's needed. Where possible, prefer samples_soa,
+        which holds one column of values per signal, and is much cheaper to work with.
+        """
+        return list(self._zip_samples())
+
+
+    def _zip_samples(self):
+        """ Returns an iterator that builds a dictionary of name -> integer value for each sample in samples_soa. """
+
+        columns = [column.tolist() for column in self.samples_soa.values()]
+        names   = self._signal_names
+
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+
+    def save_samples(self, filename):
+        """ Saves our raw samples to a NumPy .npy file, fetching them first if necessary.
+
+        The samples are stored as a single (sample_depth, bytes_per_sample) array of bytes,
+        which is much cheaper to write and to read back than pickling each sample.
+        """
+
+        bytes_per_sample = self.ila.bytes_per_sample
+        raw_samples      = np.frombuffer(self._raw_samples, dtype=np.uint8)
+
+        np.save(filename, raw_samples[:len(raw_samples) - len(raw_samples) % bytes_per_sample].reshape(-1, bytes_per_sample))
+
+
+    def load_samples(self, filename):
+        """ Loads raw samples saved by save_samples(), in place of fetching them from the ILA. """
+
+        # Map our file rather than reading it in; we only need to look at each sample once.
+        self._set_raw_samples(np.load(filename, mmap_mode='r'))
+
+
+    def enumerate_samples(self):
+        """ Returns an iterator that returns pairs of (timestamp, sample). """
+
+        yield from zip(self.timestamps.tolist(), self._zip_samples())
 
 
     def print_samples(self):
@@ -1041,11 +2096,12 @@ class ILAFrontend(metaclass=ABCMeta):
 
         for timestamp, sample in self.enumerate_samples():
             timestamp_scaled = 1000000 * timestamp
-            print(f"{timestamp_scaled:08f}us: {sample}")
+            values = ", ".join(f"'{name}': 0b{sample[name]:0{width}b}" for name, width in self._signal_info)
+            print(f"{timestamp_scaled:08f}us: {{{values}}}")
 
 
 
-    def emit_vcd(self, filename, *, gtkw_filename=None, add_clock=True):
+    def emit_vcd(self, filename, *, gtkw_filename=None, add_clock=True, output_format='vcd'):
         """ Emits a VCD file containing the ILA samples.
 
         Parameters:
@@ -1055,48 +2111,144 @@ class ILAFrontend(metaclass=ABCMeta):
                              order provided to the ILA.
             add_clock     -- If true or not provided, adds a replica of the ILA's sample
                              clock to make change points easier to see.
+            output_format -- 'vcd' (the default) for a plain VCD, 'vcd.gz' for a gzipped VCD,
+                             or 'fst' for an FST file, which requires GTKWave's vcd2fst.
+                             Long captures produce much smaller files as FST.
         """
 
+        converter = None
+
         # Select the file-like object we're working with.
         if filename == "-":
+            if output_format != 'vcd':
+                raise ValueError("only plain VCDs can be written to stdout")
+
             stream = sys.stdout
             close_after = False
-        else:
-            stream = open(filename, 'w')
+        elif output_format == 'vcd':
+            stream = open(filename, 'w', buffering=self.VCD_BUFFER_SIZE)
             close_after = True
+        elif output_format == 'vcd.gz':
+            # Favor speed over size; the lowest compression level already gets most of the way there.
+            stream = gzip.open(filename, 'wt', compresslevel=1)
+            close_after = True
+        elif output_format == 'fst':
+            # Convert our VCD on the fly, by piping it through GTKWave's converter.
+            converter = subprocess.Popen(["vcd2fst", "-", filename], stdin=subprocess.PIPE, text=True)
+            stream = converter.stdin
+            close_after = True
+        else:
+            raise ValueError(f"unknown output format '{output_format}'; expected one of 'vcd', 'vcd.gz' or 'fst'")
 
-        # Create our basic VCD.
-        with VCDWriter(stream, timescale=f"1 ns", date='today') as writer:
-            first_timestamp = math.inf
-            last_timestamp  = 0
-
-            signals = {}
-
-            # If we're adding a clock...
-            if add_clock:
-                clock_value  = 1
-                clock_signal = writer.register_var('ila', 'ila_clock', 'integer', size=1, init=clock_value ^ 1)
-
-            # Create named values for each of our signals.
-            for signal in self.ila.signals:
-                signals[signal.name] = writer.register_var('ila', signal.name, 'integer', size=len(signal))
-
-            # Dump the each of our samples into the VCD.
-            clock_time = 0
-            for timestamp, sample in self.enumerate_samples():
-                for signal_name, signal_value in sample.items():
+        try:
+            # Create our basic VCD.
+            with VCDWriter(stream, timescale=f"1 ns", date='today') as writer:
+                signals      = {}
+                clock_signal = None
+
+                # If we're adding a clock...
+                if add_clock:
+                    clock_signal = writer.register_var('ila', 'ila_clock', 'integer', size=1, init=0)
+
+                # Create named values for each of our signals.
+                for name, width in self._signal_info:
+                    signals[name] = writer.register_var('ila', name, 'integer', size=width)
+
+                # Write our changes out on a worker thread, which we hand large chunks of VCD text at a time.
+                # This way, preparing our changes overlaps with writing them out.
+                chunks  = queue.Queue(maxsize=2)
+                errors  = []
+                encoder = threading.Thread(
+                    target=self._write_vcd_chunks,
+                    args=(stream, chunks, errors),
+                    daemon=True
+                )
+                encoder.start()
+
+                try:
+                    variables      = [signals[name] for name in self.samples_soa]
+                    change_indices = []
+                    change_signals = []
+                    change_values  = []
+
+                    # Find where each of our signals changes, a whole column at a time;
+                    # there's no need to repeat unchanged values...
+                    for signal_number, column in enumerate(self.samples_soa.values()):
+                        changed     = np.ones(len(column), dtype=bool)
+                        changed[1:] = column[1:] != column[:-1]
+
+                        indices = np.flatnonzero(changed)
+                        change_indices.append(indices)
+                        change_signals.append(np.full(len(indices), signal_number))
+                        change_values.append(column[indices])
+
+                    change_indices = np.concatenate(change_indices)
+                    change_times   = self.timestamps[change_indices]
+                    change_signals = np.concatenate(change_signals)
+
+                    # If we're adding a clock, generate all of its edges at once; toggling every half sample
+                    # period, up until our last sample. We accumulate our edge times one half period at a time,
+                    # just as we accumulate our timestamps, so our edges land exactly where they always have.
+                    if (clock_signal is not None) and len(self.timestamps):
+                        half_periods = np.full(2 * len(self.timestamps), self.ila.sample_period / 2)
+                        clock_times  = np.cumsum(np.concatenate(([0.0], half_periods)))
+                        clock_times  = clock_times[clock_times < self.timestamps[-1]]
+
+                        variables.append(clock_signal)
+                        change_times   = np.concatenate((change_times, clock_times))
+                        change_signals = np.concatenate((change_signals, np.full(len(clock_times), len(variables) - 1)))
+                        change_values.append((1 - np.arange(len(clock_times)) % 2).astype(np.uint64))
+
+                    # Put all of our changes back into time order. Where a clock edge coincides with
+                    # a sample, our sample comes first; otherwise, changes keep their signal order.
+                    is_clock       = change_signals == len(self.samples_soa)
+                    change_order   = np.lexsort((is_clock, change_times))
+                    change_times   = change_times[change_order] * 1e9
+                    change_signals = change_signals[change_order].astype(np.int64)
+                    change_values  = np.concatenate(change_values)[change_order]
+
+                    # Our initial values go through pyvcd, which writes them into our $dumpvars section
+                    # along with our header. We then take over and write the rest of our body ourselves.
+                    initial_changes = int(np.count_nonzero(change_times == 0))
+                    for n, value in zip(change_signals[:initial_changes].tolist(), change_values[:initial_changes].tolist()):
+                        writer.change(variables[n], 0, value)
+                    writer.flush()
+
+                    # Our timestamps are truncated to whole nanoseconds, and we only need to write one
+                    # each time it moves on from the last one written, which is the #0 of our $dumpvars.
+                    change_times = change_times[initial_changes:].astype(np.int64)
+                    new_time     = np.empty(len(change_times), dtype=bool)
+                    new_time[:1] = change_times[:1] != 0
+                    new_time[1:] = change_times[1:] != change_times[:-1]
+
+                    change_signals = change_signals[initial_changes:]
+                    change_values  = change_values[initial_changes:]
+
+                    for chunk in self._format_vcd_chunks(variables, change_times, new_time, change_signals, change_values):
+                        chunks.put(chunk)
+
+                # Always let our encoder know we're done, so it can finish up.
+                finally:
+                    chunks.put(None)
+                    encoder.join()
+
+                if errors:
+                    raise errors[0]
 
-                    # If we're adding a clock signal, add any changes necessary since
-                    # the last value-change.
-                    if add_clock:
-                        while clock_time < timestamp:
-                            writer.change(clock_signal, clock_time / 1e-9, clock_value)
+        finally:
+            try:
+                if close_after:
+                    stream.close()
 
-                            clock_value ^= 1
-                            clock_time  += (self.ila.sample_period / 2)
+            # Always reap our converter, even if closing its input fails.
+            finally:
+                if converter:
+                    converter.wait()
 
-                    # Register the signal change.
-                    writer.change(signals[signal_name], timestamp / 1e-9, signal_value.to_int())
+        # Only check on our converter once everything above has succeeded; if something failed
+        # on the way, e.g. because our converter died mid-write, that's the error to report.
+        if converter and (converter.returncode != 0):
+            raise RuntimeError(f"vcd2fst failed to convert {filename}")
 
 
         # If we're generating a GTKW, delegate that to our helper function.
@@ -1105,6 +2257,87 @@ class ILAFrontend(metaclass=ABCMeta):
             self._emit_gtkw(gtkw_filename, filename, add_clock=add_clock)
 
 
+    def _format_vcd_chunks(self, variables, change_times, new_time, change_signals, change_values):
+        """ Returns an iterator that formats our value changes as chunks of VCD text.
+
+        Parameters:
+            variables      -- The pyvcd variable for each signal number.
+            change_times   -- An int64 array of the time of each change, in nanoseconds.
+            new_time       -- A boolean array; true for each change that needs a new #<time> line before it.
+            change_signals -- An int64 array of the signal number each change applies to.
+            change_values  -- An array of the new value of each change.
+        """
+
+        chunk_size = self.VCD_CHUNK_SAMPLES
+
+        # If we have Numba, and all of our values fit in a machine word, we can hand our changes
+        # to our compiled kernel, which formats each chunk straight into a reusable buffer.
+        if NUMBA_AVAILABLE and (change_values.dtype != object):
+            widths        = np.array([var.size for var in variables], dtype=np.int64)
+            ident_lengths = np.array([len(var.ident) for var in variables], dtype=np.int64)
+            idents        = np.zeros((len(variables), int(ident_lengths.max())), dtype=np.uint8)
+            for n, var in enumerate(variables):
+                idents[n, :len(var.ident)] = np.frombuffer(var.ident.encode('ascii'), dtype=np.uint8)
+
+            # Each change takes at most a #<time> line, and a 'b<value> <ident>' line.
+            longest_change = 22 + 3 + int(widths.max()) + int(ident_lengths.max())
+            out_buf        = np.empty(chunk_size * longest_change, dtype=np.uint8)
+
+            for start in range(0, len(change_times), chunk_size):
+                end    = start + chunk_size
+                length = emit_body(
+                    change_times[start:end], new_time[start:end], change_signals[start:end], change_values[start:end],
+                    widths, idents, ident_lengths, out_buf
+                )
+                yield out_buf[:length].tobytes().decode('ascii')
+
+            return
+
+        # Otherwise, each of our value changes is written as <prefix><value in binary><suffix>;
+        # single-bit values are written bare, and wider ones as binary vectors.
+        prefixes = ['' if var.size == 1 else 'b' for var in variables]
+        suffixes = [f'{var.ident}\n' if var.size == 1 else f' {var.ident}\n' for var in variables]
+
+        change_times   = change_times.tolist()
+        new_time       = new_time.tolist()
+        change_signals = change_signals.tolist()
+        change_values  = change_values.tolist()
+
+        for start in range(0, len(change_times), chunk_size):
+            end = start + chunk_size
+            yield "".join([
+                f"#{time}\n{prefixes[n]}{value:b}{suffixes[n]}" if is_new else f"{prefixes[n]}{value:b}{suffixes[n]}"
+                for time, is_new, n, value in zip(
+                    change_times[start:end], new_time[start:end], change_signals[start:end], change_values[start:end]
+                )
+            ])
+
+
+    def _write_vcd_chunks(self, stream, chunks, errors):
+        """ Worker that writes chunks of VCD text to a stream, until it receives None.
+
+        Parameters:
+            stream -- The file-like object to write to.
+            chunks -- The queue our chunks arrive on. Chunks must arrive in the order they're to be written.
+            errors -- A list that any exception raised while writing is appended to.
+        """
+
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+
+            # If we've already failed, just keep draining our queue.
+            if errors:
+                continue
+
+            try:
+                stream.write(chunk)
+
+            except Exception as e:
+                errors.append(e)
+
+
     def _emit_gtkw(self, filename, dump_filename, *, add_clock=True):
         """ Emits a GTKWave save file to accompany a generated VCD.
 
@@ -1137,23 +2370,27 @@ class ILAFrontend(metaclass=ABCMeta):
             gtkw.signals_width(500)
 
             # Add each of our signals to the file.
-            for signal in self.ila.signals:
-                gtkw.trace(f"ila.{signal.name}")
+            for name in self._signal_names:
+                gtkw.trace(f"ila.{name}")
 
 
     def interactive_display(self, *, add_clock=True):
         """ Attempts to spawn a GTKWave instance to display the ILA results interactively. """
 
-        # Hack: generate files in a way that doesn't trip macOS's fancy guards.
-        try:
-            vcd_filename = os.path.join(tempfile.gettempdir(), os.urandom(24).hex() + '.vcd')
-            gtkw_filename = os.path.join(tempfile.gettempdir(), os.urandom(24).hex() + '.gtkw')
+        # Hack: generate files in a way that doesn't trip macOS's fancy guards;
+        # we only reserve our filenames here, and close them again right away.
+        with tempfile.NamedTemporaryFile(suffix='.vcd', delete=False) as vcd_file:
+            vcd_filename = vcd_file.name
+        with tempfile.NamedTemporaryFile(suffix='.gtkw', delete=False) as gtkw_file:
+            gtkw_filename = gtkw_file.name
 
+        try:
             self.emit_vcd(vcd_filename, gtkw_filename=gtkw_filename)
             subprocess.run(["gtkwave", "-f", vcd_filename, "-a", gtkw_filename])
         finally:
-            os.remove(vcd_filename)
-            os.remove(gtkw_filename)
+            for filename in (vcd_filename, gtkw_filename):
+                if os.path.exists(filename):
+                    os.remove(filename)
 
 
 class AsyncSerialILAFrontend(ILAFrontend):
@@ -1176,32 +2413,320 @@ class AsyncSerialILAFrontend(ILAFrontend):
         super().__init__(ila)
 
 
-    def _split_samples(self, all_samples):
-        """ Returns an iterator that iterates over each sample in the raw binary of samples. """
-        from ..utils.bits import bits
+    def _read_raw_samples(self):
+        """ Reads the raw binary of a set of ILA samples, and returns it; as one big-endian word per sample. """
 
         sample_width_bytes = self.ila.bytes_per_sample
+        total_to_read      = self.ila.sample_depth * sample_width_bytes
 
-        # Iterate over each sample, and yield its value as a bits object.
-        for i in range(0, len(all_samples), sample_width_bytes):
-            raw_sample    = all_samples[i:i + sample_width_bytes]
-            sample_length = len(Cat(self.ila.signals))
+        # Fetch all of our samples from the given device, into a buffer of exactly the right size.
+        # Each read returns whatever has arrived so far; so keep reading until we have a full set of samples,
+        # or until a read times out without returning anything.
+        raw_samples = bytearray(total_to_read)
+        position    = 0
+
+        with memoryview(raw_samples) as buffer:
+            while position < total_to_read:
+                bytes_read = self._port.readinto(buffer[position:])
+                if not bytes_read:
+                    break
+
+                position += bytes_read
+
+        # Our UART sends each sample least significant byte first; flip each complete sample around,
+        # in place, into the big-endian form the rest of our frontend works with. We let go of our view
+        # right after, as our buffer can't be resized while it's in use.
+        complete_samples    = np.frombuffer(raw_samples, dtype=np.uint8, count=position - position % sample_width_bytes)
+        complete_samples    = complete_samples.reshape(-1, sample_width_bytes)
+        complete_samples[:] = complete_samples[:, ::-1]
+        del complete_samples
+
+        # If we timed out, only return the samples we actually received.
+        if position < total_to_read:
+            del raw_samples[position:]
+
+        # Otherwise, some devices send a few more bytes than a full set of samples. Discard whatever of those
+        # has already arrived, so they don't shift every sample of our next capture; but don't wait for more,
+        # as a device that's already sending its next capture may never go quiet.
+        else:
+            self._port.read(self._port.in_waiting)
 
-            yield bits.from_bytes(raw_sample, length=sample_length, byteorder='big')
+        return raw_samples
 
 
     def _read_samples(self):
-        """ Reads a set of ILA samples, and returns them. """
+        """ Reads a set of ILA samples, and returns them, each as an integer.
+
+        Our frontend itself reads its samples through _read_raw_samples(), which skips decoding them one by one.
+        """
 
         sample_width_bytes = self.ila.bytes_per_sample
-        total_to_read      = self.ila.sample_depth * sample_width_bytes
+        all_samples        = self._read_raw_samples()
+        sample_bytes       = len(all_samples) - len(all_samples) % sample_width_bytes
+
+        return [int.from_bytes(all_samples[i:i + sample_width_bytes], byteorder='big') for i in range(0, sample_bytes, sample_width_bytes)]
+
+
+    def read_zero_copy(self, callback):
+        """ Reads a set of ILA samples, and hands each raw sample to a callback without copying it.
+
+        Parameters:
+            callback -- Called once per sample, in order, with a memoryview of that sample's
+                        bytes_per_sample raw bytes, most significant byte first. The view is only valid until the callback
+                        returns; callbacks that want to keep a sample should call .tobytes().
+        """
+
+        sample_width_bytes = self.ila.bytes_per_sample
+
+        # If our read timed out partway through a sample, leave that partial sample out.
+        with memoryview(self._read_raw_samples()) as all_samples:
+            for i in range(0, len(all_samples) - len(all_samples) % sample_width_bytes, sample_width_bytes):
+                callback(all_samples[i:i + sample_width_bytes])
+
+
+class AsyncSerialILAFrontendTest(unittest.TestCase):
+
+    class FakePort:
+        """ Stand-in for a serial port, which delivers bursts of data a few bytes per read.
+        Each burst arrives only once the last one has been read; so only the current burst is ever waiting.
+        Once we're out of bursts, we either time out on every read; or, if we've been given an endless fill,
+        keep returning that forever.
+        """
+
+        def __init__(self, *bursts, bytes_per_read=3, endless_fill=None):
+            self.bursts         = [bytearray(burst) for burst in bursts]
+            self.bytes_per_read = bytes_per_read
+            self.endless_fill   = endless_fill
+
+        @property
+        def in_waiting(self):
+            if not self.bursts:
+                return 0 if self.endless_fill is None else self.bytes_per_read
+
+            return len(self.bursts[0])
+
+        def read(self, size):
+            buffer = bytearray(size)
+            return bytes(buffer[:self.readinto(buffer)])
+
+        def readinto(self, buffer):
+            if not self.bursts and (self.endless_fill is not None):
+                self.bursts.append(bytearray(self.endless_fill) * self.bytes_per_read)
+
+            if not self.bursts:
+                return 0
+
+            burst = self.bursts[0]
+            count = min(len(buffer), len(burst), self.bytes_per_read)
+            buffer[:count] = burst[:count]
+            del burst[:count]
+
+            if not burst:
+                del self.bursts[0]
+
+            return count
+
+
+    def setUp(self):
+        self.ila = AsyncSerialILA(signals=[Signal(4, name="low"), Signal(8, name="high")], sample_depth=8, divisor=10)
+
+    def frontend_for(self, port):
+        # Skip opening a real serial port; use our fake one in its place.
+        frontend = AsyncSerialILAFrontend.__new__(AsyncSerialILAFrontend)
+        frontend._port = port
+        ILAFrontend.__init__(frontend, self.ila)
+        return frontend
+
+    def capture(self, first_value, byteorder='little'):
+        # Our UART sends each sample least significant byte first; while our frontend keeps its raw
+        # samples most significant byte first.
+        return b"".join(i.to_bytes(2, byteorder=byteorder) for i in range(first_value, first_value + 8))
+
+    def test_short_reads_and_overrun(self):
+        # Deliver two captures, the first of which is followed by a few unexpected extra bytes.
+        port     = self.FakePort(self.capture(0x100) + b"\xAA\xBB\xCC", self.capture(0x200))
+        frontend = self.frontend_for(port)
+
+        frontend.refresh()
+        self.assertEqual(frontend.samples_soa["low"].tolist(),  [0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7])
+        self.assertEqual(frontend.samples_soa["high"].tolist(), [0x10] * 8)
+
+        # Our extra bytes shouldn't have shifted our next capture.
+        frontend.refresh()
+        self.assertEqual(bytes(frontend._raw_samples), self.capture(0x200, byteorder='big'))
+
+    def test_endless_overrun(self):
+        # A device that never stops sending shouldn't keep us from returning our capture.
+        port     = self.FakePort(self.capture(0x100) + b"\xAA", endless_fill=b"\xFF")
+        frontend = self.frontend_for(port)
+
+        frontend.refresh()
+        self.assertEqual(bytes(frontend._raw_samples), self.capture(0x100, byteorder='big'))
+
+    def test_read_samples(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        self.assertEqual(frontend._read_samples(), list(range(0x100, 0x108)))
+
+    def test_timeout(self):
+        # A capture cut short should only return the samples that arrived.
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)[:5]))
+        frontend.refresh()
+        self.assertEqual(len(frontend.samples), 2)
+
+    def test_emit_vcd(self):
+        samples  = [0x100, 0x100, 0x101, 0x201, 0x201, 0x203, 0x203, 0x203]
+        frontend = self.frontend_for(self.FakePort(b"".join(sample.to_bytes(2, byteorder='little') for sample in samples)))
+        frontend.refresh()
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "capture.vcd")
+            frontend.emit_vcd(filename)
+
+            with open(filename) as f:
+                body = f.read().split("$enddefinitions $end\n")[1]
+
+        # Our body should only hold changes; each under a single #<time> line, with our
+        # clock's single bit written bare, and our vectors in binary.
+        self.assertEqual(body.splitlines(), [
+            '#0', '$dumpvars', '1!', 'b0 "', 'b10000 #', '$end',
+            '#8',  '0!',
+            '#16', '1!',
+            '#25', '0!',
+            '#33', 'b1 "', '1!',
+            '#41', '0!',
+            '#50', 'b100000 #', '1!',
+            '#58', '0!',
+            '#66', '1!',
+            '#75', '0!',
+            '#83', '1!', 'b11 "',
+            '#91', '0!',
+            '#99', '1!',
+            '#108', '0!',
+            '#116', '1!',
+        ])
+
+    def test_save_and_load_samples(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        frontend.refresh()
+
+        with tempfile.TemporaryDirectory() as directory:
+            samples_filename = os.path.join(directory, "capture.npy")
+            frontend.save_samples(samples_filename)
+
+            # Samples loaded into a fresh frontend should match the ones we saved, however we look at them.
+            loaded = self.frontend_for(self.FakePort())
+            loaded.load_samples(samples_filename)
+
+            for name in ("low", "high"):
+                self.assertEqual(loaded.samples_soa[name].tolist(), frontend.samples_soa[name].tolist())
+            self.assertEqual(loaded.timestamps.tolist(), frontend.timestamps.tolist())
+
+            saved_vcd  = os.path.join(directory, "saved.vcd")
+            loaded_vcd = os.path.join(directory, "loaded.vcd")
+            frontend.emit_vcd(saved_vcd)
+            loaded.emit_vcd(loaded_vcd)
+
+            with open(saved_vcd) as saved, open(loaded_vcd) as loaded_file:
+                self.assertEqual(loaded_file.read(), saved.read())
+
+            # Let go of our loaded samples, which map the file we're about to clean up.
+            loaded.invalidate()
+
+    def test_emit_gtkw(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        frontend.refresh()
+
+        with tempfile.TemporaryDirectory() as directory:
+            gtkw_filename = os.path.join(directory, "capture.gtkw")
+            frontend.emit_vcd(os.path.join(directory, "capture.vcd"), gtkw_filename=gtkw_filename)
+
+            with open(gtkw_filename) as f:
+                lines = f.read().splitlines()
+
+        # Each of our signals should be traced in order, after our clock.
+        traces = [line for line in lines if line.startswith("ila.")]
+        self.assertEqual(traces, ["ila.ila_clock", "ila.low", "ila.high"])
+
+    def test_emit_vcd_gz(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        frontend.refresh()
+
+        # A gzipped VCD should hold exactly what a plain one does.
+        with tempfile.TemporaryDirectory() as directory:
+            plain_filename = os.path.join(directory, "capture.vcd")
+            gz_filename    = os.path.join(directory, "capture.vcd.gz")
+
+            frontend.emit_vcd(plain_filename)
+            frontend.emit_vcd(gz_filename, output_format='vcd.gz')
+
+            with open(plain_filename) as plain, gzip.open(gz_filename, 'rt') as compressed:
+                self.assertEqual(compressed.read(), plain.read())
+
+    def test_compiled_vcd_body(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        frontend.refresh()
+
+        # Split our changes over several chunks, so we also check that each one picks up where the last left off.
+        frontend.VCD_CHUNK_SAMPLES = 5
+
+        def emit(filename, use_kernel):
+            # Run our kernel as plain Python, whether or not Numba is around to compile it.
+            kernel = getattr(emit_body, 'py_func', emit_body)
+            with unittest.mock.patch.multiple(sys.modules[__name__], NUMBA_AVAILABLE=use_kernel, emit_body=kernel):
+                frontend.emit_vcd(filename)
+
+            with open(filename) as f:
+                return f.read()
+
+        # Our kernel should produce exactly the same text as formatting our changes in Python.
+        with tempfile.TemporaryDirectory() as directory:
+            python_vcd = emit(os.path.join(directory, "python.vcd"), use_kernel=False)
+            kernel_vcd = emit(os.path.join(directory, "kernel.vcd"), use_kernel=True)
+            self.assertEqual(kernel_vcd, python_vcd)
+
+    def test_emit_fst_errors(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+        frontend.refresh()
+
+        class FakeConverter:
+            """ Stand-in for a vcd2fst process, which exits with an error; optionally, before we're done writing. """
+
+            def __init__(self, *args, dies_early, **kwargs):
+                self.stdin      = io.StringIO()
+                self.returncode = None
+
+                if dies_early:
+                    self.stdin.write = self.broken_pipe
+
+            def broken_pipe(self, data):
+                raise BrokenPipeError()
+
+            def wait(self):
+                self.returncode = 1
+                return self.returncode
+
+        # A converter that fails should be reported...
+        with unittest.mock.patch('subprocess.Popen', lambda *args, **kwargs: FakeConverter(dies_early=False)):
+            with self.assertRaises(RuntimeError):
+                frontend.emit_vcd("capture.fst", output_format='fst')
+
+        # ... unless it's already caused an error of its own, which should be what we see.
+        with unittest.mock.patch('subprocess.Popen', lambda *args, **kwargs: FakeConverter(dies_early=True)):
+            with self.assertRaises(BrokenPipeError):
+                frontend.emit_vcd("capture.fst", output_format='fst')
+
+    def test_zero_copy(self):
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)))
+
+        received = []
+        frontend.read_zero_copy(lambda sample: received.append(sample.tobytes()))
+        self.assertEqual(b"".join(received), self.capture(0x100, byteorder='big'))
+        self.assertEqual({len(sample) for sample in received}, {2})
+
+    def test_zero_copy_timeout(self):
+        # A sample cut short by a timeout should never be handed to our callback.
+        frontend = self.frontend_for(self.FakePort(self.capture(0x100)[:5]))
 
-        # Fetch all of our samples from the given device.
-        # TODO: figure out why the bytes to read sometimes
-        # are greater than the total.
-        # in that case we would get and Overflow error.
-        # If we make instead the bytes to read larger than
-        # the actual file the read will timeout but still
-        # return a correct, full trace
-        all_samples = self._port.read(2 * total_to_read)
-        return list(self._split_samples(all_samples))
\ No newline at end of file
+        received = []
+        frontend.read_zero_copy(lambda sample: received.append(sample.tobytes()))
+        self.assertEqual(received, [b"\x01\x00", b"\x01\x01"])
@@ -4,6 +4,18 @@ export GENERATE_VCDS=1
 
 python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerBasicTest
 python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerPretriggerTest
+python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerTraceMaskTest
+python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerCompressedTest
+python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerCompressedAutoWidthTest
+python3 -m unittest amlib.debug.ila.IntegratedLogicAnalyzerDoubleBufferedTest
+python3 -m unittest amlib.debug.ila.SyncSerialPretriggerReadoutILATest
+python3 -m unittest amlib.debug.ila.StreamILATest
+python3 -m unittest amlib.debug.ila.StreamILASynchronousTest
+python3 -m unittest amlib.debug.ila.StreamILASingleSampleTest
+python3 -m unittest amlib.debug.ila.StreamILAShallowFIFOTest
+python3 -m unittest amlib.debug.ila.AsyncSerialILATest
+python3 -m unittest amlib.debug.ila.AsyncSerialILAUnbufferedTest
+python3 -m unittest amlib.debug.ila.AsyncSerialILAFrontendTest
 
 python3 -m unittest amlib.io.spi.SPIControllerInterfaceTest
 python3 -m unittest amlib.io.spi.SPIDeviceInterfaceTest
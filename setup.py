@@ -17,14 +17,19 @@ setup(
     author_email="hansfbaier@gmail.com",
     description="library of utility cores for amaranth HDL",
     license="Apache License 2.0",
+    python_requires=">=3.8",
     setup_requires=["wheel", "setuptools", "setuptools_scm"],
     install_requires=[
+        "numpy",
         "scipy",
         "amaranth>=0.2,<=4",
         "amaranth-soc",
         "amaranth-stdio",
-        "importlib_metadata; python_version<'3.8'",
     ],
+    extras_require={
+        # Compiles the ILA frontend's VCD formatting kernel.
+        "numba": ["numba"],
+    },
     packages=find_packages(),
     project_urls={
         "Source Code": "https://github.com/hansfbaier/amlib",